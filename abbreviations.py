@@ -0,0 +1,133 @@
+import json
+from typing import Any, Dict, List, Mapping, Optional
+
+from legal_forms import is_word_char
+
+# Ключ узла префиксного дерева, под которым хранится полная форма;
+# пустая строка не совпадает ни с одним символом текста
+_END = ''
+
+# Разделители сокращения и полной формы в текстовом словаре, по приоритету
+_SEPARATORS = ('\t', ';', '=')
+
+class AbbreviationExpander:
+    """
+    Замена сокращений (подсол. -> подсолнечный, ул. -> улица) полными формами
+    за один проход по строке.
+
+    Сокращения хранятся в префиксном дереве: с каждой позиции, где начинается
+    слово, дерево проходится по символам текста, пока есть продолжение, и
+    выбирается самое длинное подходящее сокращение. Работа на строку зависит
+    от длины строки и глубины дерева, но не от размера словаря.
+    Сокращение, заканчивающееся буквой или цифрой, должно заканчиваться на
+    границе слова (ул не заменяется в "улов").
+    """
+
+    def __init__(self, abbreviations: Mapping[str, str], translation: Optional[Dict[int, str]] = None) -> None:
+        self.root: Dict[str, Any] = {}
+        self.size = 0
+        # Таблица str.translate, которой нормализуется текст (см. homoglyphs.py)
+        self.translation = translation
+        for short, full in abbreviations.items():
+            self.add(short, full)
+
+    def add(self, short: str, full: str) -> None:
+        """Добавляет сокращение; сравнение идет в нижнем регистре."""
+        short = short.strip().lower()
+        full = " ".join(full.lower().split())
+        if self.translation:
+            short = short.translate(self.translation)
+            full = full.translate(self.translation)
+        if not short or not full:
+            return
+        node = self.root
+        for char in short:
+            node = node.setdefault(char, {})
+        if _END not in node:
+            self.size += 1
+        node[_END] = full
+
+    def __len__(self) -> int:
+        return self.size
+
+    def shorts(self) -> List[str]:
+        """Все сокращения словаря в том виде, в котором они ищутся в тексте."""
+        found = []
+        stack = [('', self.root)]
+        while stack:
+            prefix, node = stack.pop()
+            for char, child in node.items():
+                if char == _END:
+                    found.append(prefix)
+                else:
+                    stack.append((prefix + char, child))
+        return found
+
+    def expand(self, text: str) -> str:
+        """Текст (в нижнем регистре) с сокращениями, замененными полными формами."""
+        root = self.root
+        length = len(text)
+        pieces = []
+        last = 0
+        pos = 0
+        while pos < length:
+            node = root.get(text[pos])
+            if node is None or (pos and is_word_char(text[pos - 1])):
+                pos += 1
+                continue
+
+            best_end = 0
+            best = None
+            end = pos + 1
+            while True:
+                full = node.get(_END)
+                if full is not None and (end == length or not is_word_char(text[end - 1])
+                                         or not is_word_char(text[end])):
+                    best_end, best = end, full
+                if end == length:
+                    break
+                node = node.get(text[end])
+                if node is None:
+                    break
+                end += 1
+
+            if best is None:
+                pos += 1
+                continue
+            pieces.append(text[last:pos])
+            pieces.append(best)
+            # "подсол.b50" -> "подсолнечный b50": полная форма не должна слипаться со следующим словом
+            if best_end < length and is_word_char(text[best_end]):
+                pieces.append(' ')
+            last = pos = best_end
+
+        if not pieces:
+            return text
+        pieces.append(text[last:])
+        return ''.join(pieces)
+
+def load_abbreviations(path: str) -> Dict[str, str]:
+    """
+    Читает словарь сокращений пользователя.
+
+    Файл .json - объект {"сокращение": "полная форма"}. Остальные файлы
+    читаются построчно как текст: в строке сокращение и полная форма через
+    табуляцию, ";" или "=", пустые строки и строки с # в начале пропускаются.
+    Построчное чтение подходит для словарей на сотни тысяч записей.
+    """
+    if path.lower().endswith('.json'):
+        with open(path, 'r', encoding='utf-8-sig') as file:
+            return {str(short): str(full) for short, full in json.load(file).items()}
+
+    abbreviations: Dict[str, str] = {}
+    with open(path, 'r', encoding='utf-8-sig') as file:
+        for line in file:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            for separator in _SEPARATORS:
+                short, found, full = line.partition(separator)
+                if found:
+                    abbreviations[short.strip()] = full.strip()
+                    break
+    return abbreviations
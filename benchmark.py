@@ -0,0 +1,555 @@
+"""
+Бенчмарки FuzzyMatchTool на данных EXAMPLE из text.py.
+
+Запуск:
+    python benchmark.py memory --rows 20000
+    python benchmark.py cleaning
+    python benchmark.py lemmatization --rows 20000
+    python benchmark.py vectorized --rows 100000
+    python benchmark.py abbreviations --sizes 10 1000 100000
+    python benchmark.py normalizers --similarity 90
+    python benchmark.py reading --rows 10000 100000 1000000
+    python benchmark.py export --rows 100000 1000000
+    python benchmark.py streaming --rows 300000 --reference-rows 5000 --chunk-rows 20000
+    python benchmark.py pipeline --rows 20000 --similarity 60
+    python benchmark.py layout --rows 100000 --fanout 10
+    python benchmark.py snapshot --rows 200000
+"""
+import argparse
+import copy
+import multiprocessing
+import os
+import random
+import re
+import tempfile
+import time
+from typing import Callable, List, Optional, Tuple
+
+import pandas as pd
+
+from text import EXAMPLE
+
+def example_values(column: str) -> List[str]:
+    """Непустые значения столбца из EXAMPLE."""
+    return [value for value in EXAMPLE[column].values() if isinstance(value, str)]
+
+def synthetic_data(rows: int, seed: int = 0) -> pd.DataFrame:
+    """
+    Набор data1/data2 заданного размера на основе значений data2 из EXAMPLE:
+    к значениям добавляются номера и мелкие искажения, чтобы строки были уникальными.
+    """
+    random.seed(seed)
+    base = example_values('data2')
+    data2 = [f"{random.choice(base)} {i}" for i in range(rows)]
+    data1 = [value[:-1] if random.random() < 0.5 else value.upper() for value in data2]
+    random.shuffle(data1)
+    return pd.DataFrame({'data1': data1, 'data2': data2})
+
+def _time_per_item(function: Callable[[str], str], values: List[str], repeat: int = 3) -> float:
+    """Лучшее из repeat время обработки одного значения, мкс."""
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for value in values:
+            function(value)
+        best = min(best, time.perf_counter() - started)
+    return best / len(values) * 1e6
+
+def bench_cleaning() -> None:
+    """
+    Сравнивает clean_text_optimized + default_process с build_cleaner
+    на значениях EXAMPLE при текущей конфигурации и без лемматизации.
+    """
+    from rapidfuzz.utils import default_process
+    from utils import build_cleaner, clean_text_optimized, load_config
+
+    values = example_values('data1') + example_values('data2')
+    config = load_config()
+    no_lemma_config = copy.deepcopy(config)
+    no_lemma_config.setdefault("cleaning_options", {})["use_stemming_or_lemmatization"] = 0
+
+    for title, cfg in (('текущая конфигурация', config), ('без лемматизации', no_lemma_config)):
+        cleaner = build_cleaner(cfg)
+        old = _time_per_item(lambda value: default_process(clean_text_optimized(value, cfg)), values)
+        new = _time_per_item(cleaner, values)
+        mismatches = sum(cleaner(value) != default_process(clean_text_optimized(value, cfg)) for value in values)
+        print(f"cleaning ({title}): {len(values)} строк, clean_text_optimized {old:.1f} мкс, "
+              f"build_cleaner {new:.1f} мкс, ускорение x{old / new:.2f}, расхождений {mismatches}")
+
+def bench_lemmatization(rows: int) -> None:
+    """
+    Лемматизация каждого слова (build_cleaner) против лемматизации
+    словаря уникальных слов (build_batch_cleaner) на синтетических данных.
+    """
+    from utils import build_batch_cleaner, build_cleaner, load_config
+
+    config = copy.deepcopy(load_config())
+    config.setdefault("cleaning_options", {})["use_stemming_or_lemmatization"] = 1
+    data = synthetic_data(rows)
+    values = data['data1'].tolist() + data['data2'].tolist()
+
+    started = time.perf_counter()
+    per_word = [build_cleaner(config)(value) for value in values]
+    per_word_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    per_vocabulary = build_batch_cleaner(config)(values)
+    per_vocabulary_time = time.perf_counter() - started
+
+    words = [word for value in values for word in value.lower().split()]
+    print(f"lemmatization: {len(values)} строк, {len(words)} слов, {len(set(words))} уникальных; "
+          f"по словам {per_word_time:.1f} сек, по словарю {per_vocabulary_time:.1f} сек, "
+          f"ускорение x{per_word_time / per_vocabulary_time:.1f}, "
+          f"расхождений {sum(a != b for a, b in zip(per_word, per_vocabulary))}")
+
+def bench_vectorized(rows: int) -> None:
+    """
+    Разбиение на слова по одной строке (_build_tokenizer) против колоночного
+    варианта на строковых функциях pyarrow (_build_column_tokenizer).
+    """
+    from utils import _build_column_tokenizer, _build_tokenizer, load_config
+
+    config = load_config()
+    tokenize_column = _build_column_tokenizer(config)
+    if tokenize_column is None:
+        print("vectorized: pyarrow не установлен")
+        return
+    tokenize = _build_tokenizer(config)
+    data = synthetic_data(rows)
+    values = data['data1'].tolist() + data['data2'].tolist()
+
+    started = time.perf_counter()
+    per_row = [tokenize(value) for value in values]
+    per_row_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    per_column = list(zip(*tokenize_column(values)))
+    per_column_time = time.perf_counter() - started
+
+    print(f"vectorized: {len(values)} строк, по строкам {per_row_time:.2f} сек, "
+          f"по столбцу {per_column_time:.2f} сек, ускорение x{per_row_time / per_column_time:.1f}, "
+          f"расхождений {sum(a != b for a, b in zip(per_row, per_column))}")
+
+def bench_abbreviations(sizes: List[int]) -> None:
+    """
+    Загрузка словаря сокращений из файла и время раскрытия сокращений на
+    строку для словарей разного размера: время на строку не должно расти.
+    """
+    from abbreviations import AbbreviationExpander, load_abbreviations
+    from utils import DEFAULT_CONFIG
+
+    random.seed(0)
+    letters = 'абвгдежзиклмнопрстуфхцчшщэюя'
+    values = [value.lower() for value in example_values('data1') + example_values('data2')]
+    values += [f"шрот подсол. b{i} ул. ленина" for i in range(len(values))]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for size in sizes:
+            abbreviations = dict(DEFAULT_CONFIG["abbreviations"])
+            while len(abbreviations) < size:
+                short = ''.join(random.choice(letters) for _ in range(random.randint(2, 8)))
+                abbreviations[short + '.'] = short * 2
+            path = os.path.join(tmp_dir, f'abbreviations_{size}.txt')
+            with open(path, 'w', encoding='utf-8') as file:
+                file.writelines(f"{short}\t{full}\n" for short, full in abbreviations.items())
+
+            started = time.perf_counter()
+            expander = AbbreviationExpander(load_abbreviations(path))
+            load_time = time.perf_counter() - started
+            per_string = _time_per_item(expander.expand, values)
+            print(f"abbreviations: словарь {len(expander)}, загрузка {load_time:.2f} сек, "
+                  f"{per_string:.2f} мкс на строку")
+
+def _normalizer_load_child(name: str, queue) -> None:
+    """Загрузка нормализатора в чистом процессе: время без уже загруженных словарей."""
+    from utils import get_normalizer
+
+    started = time.perf_counter()
+    get_normalizer(name).load()
+    queue.put(time.perf_counter() - started)
+
+def _inflect(text: str, morph, case: str) -> str:
+    """Ставит русские слова строки в падеж case (для проверки полноты на словоформах)."""
+    def inflect_word(match):
+        form = morph.parse(match.group())[0].inflect({case})
+        return form.word if form is not None else match.group()
+    return re.sub(r'[А-Яа-яЁё]+', inflect_word, text)
+
+def bench_normalizers(similarity: int) -> None:
+    """
+    Сравнивает способы нормализации слов (utils.NORMALIZERS): время загрузки,
+    время на слово и влияние на полноту. Полнота - доля значений data2 из
+    EXAMPLE, которые после постановки слов в родительный падеж все еще
+    находятся при пороге similarity; там же - число пар data1 x data2.
+    """
+    from rapidfuzz import fuzz, process
+    from utils import NORMALIZERS, _build_tokenizer, build_batch_cleaner, get_normalizer, get_morph, load_config
+
+    base_config = load_config()
+    data1 = example_values('data1')
+    data2 = example_values('data2')
+    tokenize = _build_tokenizer(base_config)
+    tokens = [word for value in data1 + data2 for word in tokenize(value)[0]]
+    morph = get_morph()
+    variants = [_inflect(value, morph, 'gent') for value in data2]
+
+    context = multiprocessing.get_context('spawn')
+    for name in NORMALIZERS:
+        queue = context.Queue()
+        child = context.Process(target=_normalizer_load_child, args=(name, queue))
+        child.start()
+        load_time = queue.get()
+        child.join()
+
+        normalize = get_normalizer(name).load()
+        per_token = _time_per_item(normalize, tokens)
+
+        config = copy.deepcopy(base_config)
+        options = config.setdefault("cleaning_options", {})
+        options["use_stemming_or_lemmatization"] = 1
+        options["normalizer"] = name
+        clean = build_batch_cleaner(config, workers=1)
+        cleaned_variants = clean(variants)
+        cleaned_data2 = clean(data2)
+        found = sum(fuzz.token_sort_ratio(a, b) >= similarity for a, b in zip(cleaned_variants, cleaned_data2))
+        pairs = int((process.cdist(clean(data1), cleaned_data2, scorer=fuzz.token_sort_ratio,
+                                   score_cutoff=similarity) >= similarity).sum())
+
+        print(f"normalizers: {name:9} загрузка {load_time:.2f} сек, {per_token:.2f} мкс на слово, "
+              f"полнота на словоформах {found / len(variants):.1%}, пар в EXAMPLE {pairs}")
+
+def bench_reading(sizes: List[int]) -> None:
+    """
+    Чтение исходных данных: pd.read_excel целиком с выводом типов (как раньше)
+    против read_data_columns (только data1/data2 строками) на openpyxl и calamine.
+    """
+    from readers import python_calamine, read_data_columns
+
+    engines = ['openpyxl'] + (['calamine'] if python_calamine is not None else [])
+    if python_calamine is None:
+        print("reading: python-calamine не установлен, замер только для openpyxl")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for rows in sizes:
+            data_file = os.path.join(tmp_dir, f'data_{rows}.xlsx')
+            synthetic_data(rows).to_excel(data_file, index=False)
+
+            started = time.perf_counter()
+            expected = pd.read_excel(data_file, engine='openpyxl')
+            timings = [f"read_excel {time.perf_counter() - started:.2f} сек"]
+            for engine in engines:
+                started = time.perf_counter()
+                df = read_data_columns(data_file, engine=engine)
+                timings.append(f"{engine} {time.perf_counter() - started:.2f} сек")
+                assert df['data1'].tolist() == expected['data1'].tolist(), engine
+            print(f"reading: {rows} строк, " + ", ".join(timings))
+
+def _export_child(method: str, rows: int, file_path: str, queue) -> None:
+    """Запись rows пар в xlsx в отдельном процессе: время и пиковая память."""
+    from memory import peak_rss_mb
+    import writers
+
+    def batches():
+        for start in range(0, rows, 10000):
+            yield [(f"ооо ромашка {i}", f"ромашка ооо {i}", 90.0) for i in range(start, min(start + 10000, rows))]
+
+    baseline = peak_rss_mb()
+    started = time.perf_counter()
+    if method == 'dataframe':
+        # Прежний способ: весь результат в DataFrame, затем to_excel
+        pairs = [(data1, data2) for batch in batches() for data1, data2, score in batch]
+        pd.DataFrame(pairs, columns=['data1', 'data2']).to_excel(file_path, index=False)
+    else:
+        writers.write_excel(batches(), file_path, engine=method)
+    queue.put((time.perf_counter() - started, peak_rss_mb() - baseline))
+
+def bench_export(sizes: List[int]) -> None:
+    """
+    Запись результатов в xlsx: DataFrame.to_excel против потоковой записи
+    (openpyxl write_only и xlsxwriter constant_memory). Память - прирост
+    пиковой памяти процесса во время записи.
+    """
+    from writers import xlsxwriter
+
+    methods = ['dataframe', 'openpyxl'] + (['xlsxwriter'] if xlsxwriter is not None else [])
+    context = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for rows in sizes:
+            results = []
+            for method in methods:
+                queue = context.Queue()
+                child = context.Process(target=_export_child,
+                                        args=(method, rows, os.path.join(tmp_dir, f'{method}.xlsx'), queue))
+                child.start()
+                elapsed, peak = queue.get()
+                child.join()
+                results.append(f"{method} {elapsed:.1f} сек / +{peak:.0f} МБ")
+            print(f"export: {rows} строк, " + ", ".join(results))
+
+def _streaming_child(data_file: str, reference_file: str, output_file: str,
+                     stream_chunk_rows: int, queue) -> None:
+    """Полный прогон create_file_matches в отдельном процессе: время и пиковая память."""
+    from comparison import create_file_matches
+    from memory import peak_rss_mb
+
+    started = time.perf_counter()
+    # reference_file используется только в потоковом режиме; без него data2 - из data_file
+    summary = create_file_matches(80, time_budget=0, max_memory_mb=0, data_file=data_file,
+                                  output_file=output_file, stream_chunk_rows=stream_chunk_rows,
+                                  reference_file=reference_file)
+    queue.put((summary.pairs_found, time.perf_counter() - started, peak_rss_mb()))
+
+def bench_streaming(rows: int, reference_rows: int, chunk_rows: int) -> None:
+    """
+    Большой data1 против небольшого справочника data2: чтение data1 целиком
+    против потокового режима (stream_chunk_rows). Пиковая память потокового
+    режима не должна расти с числом строк data1.
+    """
+    random.seed(0)
+    reference = synthetic_data(reference_rows)['data2'].tolist()
+    # Уникальные строки data1: число пар в обоих режимах должно совпасть
+    data1 = [f"{random.choice(reference).upper()}-{i}" for i in range(rows)]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        data_file = os.path.join(tmp_dir, 'data.parquet')
+        reference_file = os.path.join(tmp_dir, 'reference.parquet')
+        output_file = os.path.join(tmp_dir, 'results.parquet')
+        data2 = reference + [None] * (rows - len(reference))
+        pd.DataFrame({'data1': data1, 'data2': data2}).to_parquet(data_file)
+        pd.DataFrame({'data2': reference}).to_parquet(reference_file)
+
+        context = multiprocessing.get_context('spawn')
+        for title, stream_chunk_rows in (('целиком', 0), (f'блоками по {chunk_rows}', chunk_rows)):
+            queue = context.Queue()
+            child = context.Process(target=_streaming_child,
+                                    args=(data_file, reference_file, output_file, stream_chunk_rows, queue))
+            child.start()
+            pairs, elapsed, peak = queue.get()
+            child.join()
+            print(f"streaming: data1 {rows} строк, data2 {reference_rows}, {title}: "
+                  f"пар {pairs}, {elapsed:.1f} сек, пиковая память {peak:.0f} МБ")
+
+def bench_pipeline(rows: int, similarity: int) -> None:
+    """
+    Запись результатов в том же потоке, что и сравнение, против фоновой
+    записи через ограниченную очередь (output_options.writer_queue_batches).
+    """
+    from comparison import create_file_matches
+    from utils import load_config
+
+    output_options = load_config().setdefault("output_options", {})
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        data_file = os.path.join(tmp_dir, 'data.parquet')
+        synthetic_data(rows).to_parquet(data_file)
+        for queue_batches in (0, 8):
+            output_options["writer_queue_batches"] = queue_batches
+            summary = create_file_matches(similarity, time_budget=0, max_memory_mb=0, data_file=data_file,
+                                          output_file=os.path.join(tmp_dir, 'results.xlsx'))
+            title = f"очередь {queue_batches} пакетов" if queue_batches else "без фоновой записи"
+            print(f"pipeline: {rows} строк, {title}: пар {summary.pairs_found}, {summary.elapsed_sec:.1f} сек, "
+                  f"простой сравнения {summary.matching_blocked_sec:.1f} сек, "
+                  f"простой записи {summary.writer_blocked_sec:.1f} сек")
+
+def bench_layout(rows: int, fanout: int) -> None:
+    """
+    Запись rows строк data1 по fanout совпадений в раскладках 'long'
+    (строка на пару) и 'wide' (строка на data1) во все форматы.
+    """
+    from writers import result_columns, write_results
+
+    def batches():
+        for start in range(0, rows, 1000):
+            yield [(f"ооо ромашка {i}", f"ромашка ооо {i} {k}", 100.0 - k)
+                   for i in range(start, min(start + 1000, rows)) for k in range(fanout)]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for extension in ('xlsx', 'csv', 'parquet'):
+            timings = []
+            for layout in ('long', 'wide'):
+                file_path = os.path.join(tmp_dir, f'results_{layout}.{extension}')
+                started = time.perf_counter()
+                written = write_results(batches(), file_path, layout=layout, max_matches=fanout)
+                timings.append(f"{layout}: строк {written.rows}, столбцов {len(result_columns(layout, fanout))}, "
+                               f"{time.perf_counter() - started:.2f} сек, {os.path.getsize(file_path) / 2**20:.1f} МБ")
+            print(f"layout: {extension}, {rows} x {fanout} пар, " + "; ".join(timings))
+
+def _snapshot_child(reference_file: str, snapshot_path: str, snapshot: int, queue) -> None:
+    """Загрузка справочника data2 в новом процессе: время и прирост памяти."""
+    import comparison
+    from memory import current_rss_mb
+    from utils import load_config
+
+    config = load_config()
+    # Без постоянного кэша очистки: сравниваются полная очистка и снимок
+    config.setdefault("cache_options", {}).update(persistent_cache=0, reference_snapshot=snapshot)
+    progress = comparison._ProgressReporter(None, None)
+    baseline = current_rss_mb()
+    started = time.perf_counter()
+    processed_b, _, _ = comparison._load_reference(reference_file, 100000, config, None, progress, snapshot_path)
+    elapsed = time.perf_counter() - started
+    queue.put((progress.summary.reference_snapshot, len(processed_b), elapsed, current_rss_mb() - baseline))
+
+def bench_snapshot(rows: int) -> None:
+    """
+    Запуск против справочника data2 из rows строк: чтение и очистка файла
+    против снимка Arrow IPC (cache_options.reference_snapshot). Каждый
+    замер - в новом процессе, как при повторном пакетном запуске. Снимок
+    пишется во временную папку, снимок в working_files не трогается.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        reference_file = os.path.join(tmp_dir, 'reference.parquet')
+        snapshot_path = os.path.join(tmp_dir, 'reference_snapshot.arrow')
+        synthetic_data(rows)[['data2']].to_parquet(reference_file)
+        context = multiprocessing.get_context('spawn')
+        for title, snapshot in (('без снимка', 0), ('первый запуск', 1), ('из снимка', 1)):
+            queue = context.Queue()
+            child = context.Process(target=_snapshot_child,
+                                    args=(reference_file, snapshot_path, snapshot, queue))
+            child.start()
+            _, size, elapsed, memory = queue.get()
+            child.join()
+            print(f"snapshot: data2 {rows} строк ({size} очищенных), {title}: "
+                  f"{elapsed:.2f} сек, память +{memory:.0f} МБ")
+
+def _memory_child(data_file: str, similarity: int, max_memory_mb: float, queue) -> None:
+    """Прогон iter_matches в отдельном процессе, чтобы измерить его пиковую память."""
+    from comparison import iter_matches
+    from memory import peak_rss_mb
+
+    started = time.perf_counter()
+    pairs = sum(len(batch) for batch in iter_matches(similarity, max_memory_mb=max_memory_mb,
+                                                     data_file=data_file))
+    queue.put((pairs, time.perf_counter() - started, peak_rss_mb()))
+
+def _run_memory_child(data_file: str, similarity: int, max_memory_mb: float) -> Tuple[int, float, float]:
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    child = context.Process(target=_memory_child, args=(data_file, similarity, max_memory_mb, queue))
+    child.start()
+    pairs, elapsed, peak = queue.get()
+    child.join()
+    if peak is None:
+        raise RuntimeError("Пиковую память процесса на этой платформе измерить нельзя")
+    return pairs, elapsed, peak
+
+def bench_memory(rows: int, similarity: int, max_memory_mb: Optional[float] = None,
+                 growth: int = 3) -> Tuple[int, float, float]:
+    """
+    Проверяет, что режим ограничения памяти укладывается в потолок, который
+    без этого режима был бы превышен, и что пиковая память не растет вместе
+    с data1. Сначала замеряется пиковая память прогона без ограничения на
+    rows строк; потолок по умолчанию - 90% от нее. Заданный потолок должен
+    быть ниже пика без ограничения, иначе проверка ничего не доказывает.
+    С потолком прогоняются тот же файл (пары должны совпасть) и файл с data1
+    в growth раз длиннее при том же data2 - оба в пределах потолка.
+    Данные пишутся в CSV: в xlsx openpyxl держит в памяти всю таблицу общих
+    строк книги, и она растет вместе с файлом.
+    Возвращает (число пар, время, пиковая память в МБ) прогона с
+    ограничением на rows строк. При нарушении - AssertionError.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        data = synthetic_data(rows * growth)
+        data.loc[rows:, 'data2'] = None
+        data_file = os.path.join(tmp_dir, 'data.csv')
+        data.iloc[:rows].to_csv(data_file, index=False, encoding='utf-8-sig')
+        grown_file = os.path.join(tmp_dir, 'data_grown.csv')
+        data.to_csv(grown_file, index=False, encoding='utf-8-sig')
+
+        unbounded_pairs, unbounded_elapsed, unbounded_peak = _run_memory_child(data_file, similarity, 0)
+        if max_memory_mb is None:
+            max_memory_mb = unbounded_peak * 0.9
+        print(f"memory: rows={rows} pairs={unbounded_pairs} time={unbounded_elapsed:.1f}s "
+              f"peak_rss={unbounded_peak:.0f}MB без ограничения")
+        if unbounded_peak <= max_memory_mb:
+            raise ValueError(f"Потолок {max_memory_mb:.0f} МБ не ниже пиковой памяти без ограничения "
+                             f"({unbounded_peak:.0f} МБ): задайте меньший --max-memory-mb или больше --rows")
+
+        pairs, elapsed, peak = _run_memory_child(data_file, similarity, max_memory_mb)
+        print(f"memory: rows={rows} pairs={pairs} time={elapsed:.1f}s "
+              f"peak_rss={peak:.0f}MB limit={max_memory_mb:.0f}MB")
+        grown_pairs, grown_elapsed, grown_peak = _run_memory_child(grown_file, similarity, max_memory_mb)
+        print(f"memory: rows={rows * growth} (data2 {rows}) pairs={grown_pairs} time={grown_elapsed:.1f}s "
+              f"peak_rss={grown_peak:.0f}MB limit={max_memory_mb:.0f}MB")
+
+    assert pairs == unbounded_pairs, f"Число пар с ограничением памяти {pairs} вместо {unbounded_pairs}"
+    assert peak <= max_memory_mb, f"Пиковая память {peak:.0f} МБ превышает потолок {max_memory_mb:.0f} МБ"
+    assert grown_peak <= max_memory_mb, (f"При data1 в {growth} раза длиннее пиковая память {grown_peak:.0f} МБ "
+                                         f"превышает потолок {max_memory_mb:.0f} МБ")
+    return pairs, elapsed, peak
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    memory_parser = commands.add_parser('memory', help='пиковая память в режиме max_memory_mb')
+    memory_parser.add_argument('--rows', type=int, default=20000)
+    memory_parser.add_argument('--similarity', type=int, default=80)
+    memory_parser.add_argument('--max-memory-mb', type=float, default=None,
+                               help='потолок памяти, МБ (по умолчанию 90% пика без ограничения)')
+    memory_parser.add_argument('--growth', type=int, default=3,
+                               help='во сколько раз удлинить data1 для проверки, что память не растет')
+
+    commands.add_parser('cleaning', help='build_cleaner против clean_text_optimized')
+
+    lemmatization_parser = commands.add_parser('lemmatization', help='лемматизация по словам и по словарю')
+    lemmatization_parser.add_argument('--rows', type=int, default=20000)
+
+    vectorized_parser = commands.add_parser('vectorized', help='очистка по строкам и по столбцу (pyarrow)')
+    vectorized_parser.add_argument('--rows', type=int, default=100000)
+
+    abbreviations_parser = commands.add_parser('abbreviations', help='раскрытие сокращений и размер словаря')
+    abbreviations_parser.add_argument('--sizes', type=int, nargs='+', default=[10, 1000, 100000])
+
+    normalizers_parser = commands.add_parser('normalizers', help='способы нормализации: загрузка, скорость, полнота')
+    normalizers_parser.add_argument('--similarity', type=int, default=90)
+
+    reading_parser = commands.add_parser('reading', help='чтение xlsx: openpyxl и calamine')
+    reading_parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000, 1000000])
+
+    export_parser = commands.add_parser('export', help='запись xlsx: to_excel и потоковая запись')
+    export_parser.add_argument('--rows', type=int, nargs='+', default=[100000, 1000000])
+
+    streaming_parser = commands.add_parser('streaming', help='большой data1 блоками против справочника data2')
+    streaming_parser.add_argument('--rows', type=int, default=300000)
+    streaming_parser.add_argument('--reference-rows', type=int, default=5000)
+    streaming_parser.add_argument('--chunk-rows', type=int, default=20000)
+
+    pipeline_parser = commands.add_parser('pipeline', help='запись результатов в фоновом потоке')
+    pipeline_parser.add_argument('--rows', type=int, default=20000)
+    pipeline_parser.add_argument('--similarity', type=int, default=60)
+
+    layout_parser = commands.add_parser('layout', help='раскладки результатов long и wide')
+    layout_parser.add_argument('--rows', type=int, default=100000)
+    layout_parser.add_argument('--fanout', type=int, default=10)
+
+    snapshot_parser = commands.add_parser('snapshot', help='справочник data2 из снимка Arrow IPC')
+    snapshot_parser.add_argument('--rows', type=int, default=200000)
+
+    args = parser.parse_args()
+    if args.command == 'memory':
+        bench_memory(args.rows, args.similarity, args.max_memory_mb, args.growth)
+    elif args.command == 'cleaning':
+        bench_cleaning()
+    elif args.command == 'lemmatization':
+        bench_lemmatization(args.rows)
+    elif args.command == 'vectorized':
+        bench_vectorized(args.rows)
+    elif args.command == 'abbreviations':
+        bench_abbreviations(args.sizes)
+    elif args.command == 'normalizers':
+        bench_normalizers(args.similarity)
+    elif args.command == 'reading':
+        bench_reading(args.rows)
+    elif args.command == 'export':
+        bench_export(args.rows)
+    elif args.command == 'streaming':
+        bench_streaming(args.rows, args.reference_rows, args.chunk_rows)
+    elif args.command == 'pipeline':
+        bench_pipeline(args.rows, args.similarity)
+    elif args.command == 'layout':
+        bench_layout(args.rows, args.fanout)
+    elif args.command == 'snapshot':
+        bench_snapshot(args.rows)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from formats import replaced_on_success
+from legal_forms import CleanedName, LegalForms
+
+# Снимок справочника в формате Arrow IPC
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+except ImportError:
+    pa = None
+
+# Сколько параметров передавать в один запрос IN (...): ограничение SQLite - 999
+_SQL_CHUNK = 900
+
+# Сколько байт файла кэша SQLite читает через mmap. Отображенные страницы
+# входят в резидентную память процесса
+CACHE_MMAP_BYTES = 256 * 2**20
+
+# Версия формата снимка справочника: при изменении старые снимки не читаются
+_SNAPSHOT_VERSION = '2'
+
+# Разделитель ОПФ в столбце legal_forms кэша SQLite
+_FORMS_SEPARATOR = '\t'
+
+class PersistentCleaningCache:
+    """
+    Кэш очищенного текста на диске (SQLite), общий для всех запусков.
+    Вместе с текстом хранятся найденные ОПФ (CleanedName).
+
+    Ключ - пара (отпечаток настроек очистки, исходный текст), поэтому
+    после изменения настроек старые записи просто не находятся и со
+    временем вытесняются. При превышении max_entries удаляются записи,
+    которые дольше всего не запрашивались.
+    """
+
+    def __init__(self, path: str, fingerprint: str, max_entries: int = 1_000_000,
+                 mmap_bytes: int = CACHE_MMAP_BYTES) -> None:
+        self.fingerprint = fingerprint
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(f'''
+            PRAGMA journal_mode = WAL;
+            PRAGMA synchronous = NORMAL;
+            PRAGMA mmap_size = {int(mmap_bytes)};
+            CREATE TABLE IF NOT EXISTS cleaned (
+                fingerprint TEXT NOT NULL,
+                raw TEXT NOT NULL,
+                cleaned TEXT NOT NULL,
+                legal_forms TEXT NOT NULL DEFAULT '',
+                last_used REAL NOT NULL,
+                PRIMARY KEY (fingerprint, raw)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS cleaned_last_used ON cleaned (last_used);
+        ''')
+        columns = {row[1] for row in self.connection.execute("PRAGMA table_info(cleaned)")}
+        if 'legal_forms' not in columns:
+            # Файл от прежней версии: его записи относятся к другому отпечатку и так не находятся
+            with self.connection:
+                self.connection.execute("ALTER TABLE cleaned ADD COLUMN legal_forms TEXT NOT NULL DEFAULT ''")
+
+    def get_many(self, texts: Iterable[str]) -> Dict[str, CleanedName]:
+        """Возвращает найденные в кэше значения и отмечает их как использованные."""
+        texts = list(texts)
+        found: Dict[str, CleanedName] = {}
+        for start in range(0, len(texts), _SQL_CHUNK):
+            chunk = texts[start:start + _SQL_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self.connection.execute(
+                f"SELECT raw, cleaned, legal_forms FROM cleaned WHERE fingerprint = ? AND raw IN ({placeholders})",
+                [self.fingerprint, *chunk])
+            for raw, cleaned, legal_forms in rows:
+                found[raw] = CleanedName(cleaned, tuple(legal_forms.split(_FORMS_SEPARATOR)) if legal_forms else ())
+
+        if found:
+            now = time.time()
+            with self.connection:
+                self.connection.executemany(
+                    "UPDATE cleaned SET last_used = ? WHERE fingerprint = ? AND raw = ?",
+                    ((now, self.fingerprint, raw) for raw in found))
+        self.hits += len(found)
+        self.misses += len(texts) - len(found)
+        return found
+
+    def put_many(self, items: Dict[str, CleanedName]) -> None:
+        """Сохраняет пары (исходный текст, результат очистки) одной транзакцией."""
+        if not items:
+            return
+        now = time.time()
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO cleaned (fingerprint, raw, cleaned, legal_forms, last_used) "
+                "VALUES (?, ?, ?, ?, ?)",
+                ((self.fingerprint, raw, name.cleaned, _FORMS_SEPARATOR.join(name.legal_forms), now)
+                 for raw, name in items.items()))
+        self._evict()
+
+    def _evict(self) -> None:
+        count = self.connection.execute("SELECT COUNT(*) FROM cleaned").fetchone()[0]
+        if count <= self.max_entries:
+            return
+        # Удаляем с запасом в 10%, чтобы не вытеснять на каждом запуске
+        excess = count - int(self.max_entries * 0.9)
+        with self.connection:
+            self.connection.execute(
+                "DELETE FROM cleaned WHERE (fingerprint, raw) IN "
+                "(SELECT fingerprint, raw FROM cleaned ORDER BY last_used LIMIT ?)",
+                (excess,))
+        self.evicted += excess
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def close(self) -> None:
+        self.connection.close()
+
+class LRUCleaningCache:
+    """
+    Ограниченный кэш очищенного текста (с найденными ОПФ, CleanedName) в
+    памяти процесса с вытеснением давно не использованных записей (LRU).
+
+    Подходит для долгоживущих процессов (сессия TUI, сервис): размер не
+    растет бесконечно, а при смене настроек очистки (другой отпечаток)
+    содержимое сбрасывается. Все операции защищены блокировкой, поэтому
+    кэш можно использовать из нескольких потоков.
+    """
+
+    def __init__(self, capacity: int = 200_000) -> None:
+        self.capacity = capacity
+        self.fingerprint: Optional[str] = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data: "OrderedDict[str, CleanedName]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, text: str) -> bool:
+        with self._lock:
+            return text in self._data
+
+    def configure(self, fingerprint: str, capacity: Optional[int] = None) -> None:
+        """Задает отпечаток настроек очистки и емкость; при смене отпечатка кэш сбрасывается."""
+        with self._lock:
+            if fingerprint != self.fingerprint:
+                self._data.clear()
+                self.fingerprint = fingerprint
+            if capacity is not None:
+                self.capacity = capacity
+                self._evict()
+
+    def get(self, text: str) -> Optional[CleanedName]:
+        with self._lock:
+            cleaned = self._data.get(text)
+            if cleaned is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(text)
+            self.hits += 1
+            return cleaned
+
+    def get_many(self, texts: Iterable[str]) -> Dict[str, CleanedName]:
+        """Возвращает найденные значения; ненайденные учитываются как промахи."""
+        found: Dict[str, CleanedName] = {}
+        with self._lock:
+            for text in texts:
+                cleaned = self._data.get(text)
+                if cleaned is None:
+                    self.misses += 1
+                else:
+                    self._data.move_to_end(text)
+                    self.hits += 1
+                    found[text] = cleaned
+        return found
+
+    def put(self, text: str, cleaned: CleanedName) -> None:
+        with self._lock:
+            self._data[text] = cleaned
+            self._data.move_to_end(text)
+            self._evict()
+
+    def put_many(self, items: Dict[str, CleanedName]) -> None:
+        with self._lock:
+            for text, cleaned in items.items():
+                self._data[text] = cleaned
+                self._data.move_to_end(text)
+            self._evict()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def _evict(self) -> None:
+        # Вызывается под блокировкой
+        while len(self._data) > self.capacity:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+def snapshot_key(source_path: str, fingerprint: str) -> str:
+    """
+    Ключ снимка справочника: исходный файл (путь, размер, время изменения)
+    и отпечаток настроек очистки. Снимок с другим ключом устарел.
+    """
+    stat = os.stat(source_path)
+    return f"{_SNAPSHOT_VERSION}|{os.path.abspath(source_path)}|{stat.st_size}|{stat.st_mtime_ns}|{fingerprint}"
+
+class ReferenceSnapshot:
+    """
+    Очищенный справочник data2 в файле Arrow IPC, отображаемом в память.
+
+    В файле одна строка на уникальное очищенное значение: cleaned - само
+    значение (в порядке индекса поиска), originals - список исходных
+    значений data2, которые к нему приводятся (в Arrow это смещения и общий
+    буфер строк), legal_forms - ОПФ каждого из этих значений. Файл открывается через mmap без копирования: исходные
+    значения читаются с диска только для найденных совпадений, а процессы,
+    открывшие один снимок, делят одни и те же страницы памяти.
+    """
+
+    def __init__(self, table: "pa.Table") -> None:
+        self.table = table
+        self._originals = table.column('originals')
+        self._legal_forms = table.column('legal_forms')
+
+    @classmethod
+    def open(cls, path: str, key: str) -> Optional["ReferenceSnapshot"]:
+        """Открывает снимок; None, если его нет, он устарел или не установлен pyarrow."""
+        if pa is None or not os.path.isfile(path):
+            return None
+        source = None
+        try:
+            source = pa.memory_map(path)
+            reader = pyarrow.ipc.open_file(source)
+            metadata = reader.schema.metadata or {}
+            if metadata.get(b'key', b'').decode('utf-8') == key:
+                # Таблица ссылается на отображенный файл, поэтому он остается открытым
+                return cls(reader.read_all())
+        except (OSError, pa.ArrowInvalid):
+            # Поврежденный файл пересоздается при следующем сохранении
+            pass
+        if source is not None:
+            source.close()
+        return None
+
+    @staticmethod
+    def save(path: str, key: str, reference: Dict[str, List[str]],
+             legal_forms: Dict[str, List[LegalForms]]) -> bool:
+        """
+        Сохраняет справочник {очищенное значение: исходные значения} и
+        {очищенное значение: ОПФ исходных значений} (списки в том же порядке).
+        Файл пишется во временный и подменяется целиком, поэтому процессы,
+        уже открывшие прошлый снимок, продолжают читать его без ошибок.
+        Возвращает False, если снимок не сохранен (нет pyarrow, файл занят).
+        """
+        if pa is None:
+            return False
+        schema = pa.schema([('cleaned', pa.string()), ('originals', pa.list_(pa.string())),
+                            ('legal_forms', pa.list_(pa.list_(pa.string())))],
+                           metadata={'key': key})
+        batch = pa.record_batch([pa.array(list(reference.keys()), pa.string()),
+                                 pa.array(list(reference.values()), pa.list_(pa.string())),
+                                 pa.array([legal_forms[cleaned] for cleaned in reference],
+                                          pa.list_(pa.list_(pa.string())))], schema=schema)
+        try:
+            with replaced_on_success(path) as tmp_path:
+                with pyarrow.ipc.new_file(tmp_path, schema) as writer:
+                    writer.write_batch(batch)
+        except PermissionError:
+            # Windows не дает заменить файл, открытый другим процессом:
+            # снимок обновится при следующем запуске
+            return False
+        return True
+
+    def __len__(self) -> int:
+        return self.table.num_rows
+
+    def __getitem__(self, index: int) -> List[str]:
+        """Исходные значения для очищенного значения с номером index."""
+        return self._originals[index].as_py()
+
+    def legal_forms_at(self, index: int) -> List[LegalForms]:
+        """ОПФ исходных значений для очищенного значения с номером index."""
+        return [tuple(forms) for forms in self._legal_forms[index].as_py()]
+
+    def cleaned_values(self) -> Sequence[str]:
+        """Очищенные значения строками Python (их копия нужна rapidfuzz)."""
+        return self.table.column('cleaned').to_pylist()
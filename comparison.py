@@ -1,118 +1,910 @@
 import os
+import bisect
+import itertools
+import random
+import threading
+import time
+from functools import partial
+import numpy as np
 import pandas as pd
-from rapidfuzz import process, fuzz, utils
-from typing import Dict
-from text import NAME_DATA_FILE, NAME_OUTPUT_FILE
+from rapidfuzz import fuzz
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+from text import NAME_UNPROCESSED_FILE, NAME_CACHE_FILE, NAME_REFERENCE_SNAPSHOT
 from collections import defaultdict
 
-from custom_errors import Sheet_too_large_Error
-from utils import load_config, clean_text_optimized # Импортируем наши новые функции
+from cache import CACHE_MMAP_BYTES, LRUCleaningCache, PersistentCleaningCache, ReferenceSnapshot, snapshot_key
+from custom_errors import Comparison_cancelled_Error
+from engines import CDIST_BLOCK_BYTES, ENGINES, BruteForceEngine, CdistEngine, length_bounds
+from formats import WORKING_DIR, data_file_path, detect_format, output_file_path, reference_file_path
+from legal_forms import CleanedName, LegalForms
+from memory import (PAIR_SIZE_BYTES, SpillDeduplicator, available_budget_bytes, budget_chunk_rows, current_rss_mb,
+                    peak_rss_mb)
+from pipeline import WRITER_QUEUE_BATCHES, BackgroundWriter
+from readers import count_rows, estimate_rows, iter_column_chunks, read_data_columns, read_results
+from utils import load_config, build_cleaner, build_batch_cleaner, cleaning_fingerprint # Импортируем наши новые функции
+from writers import (PARQUET_ROW_GROUP_ROWS, WIDE_MAX_MATCHES, MatchBatch, excel_parts, write_results,
+                     write_unprocessed)
 
-# Кэширование результатов очистки
-_cleaning_cache: Dict[str, str] = {}
+# Кэширование результатов очистки: ограниченный LRU-кэш, живущий между запусками
+# (емкость - cache_options.memory_entries, сбрасывается при смене настроек очистки)
+_cleaning_cache = LRUCleaningCache()
+
+# Функции очистки, собранные под текущую конфигурацию (см. utils.build_cleaner)
+_cleaner: Optional[Callable[[str], CleanedName]] = None
+_batch_cleaner: Optional[Callable[[Iterable[str]], List[CleanedName]]] = None
+_cleaner_fingerprint: Optional[str] = None
+_cleaners_lock = threading.Lock()
+
+# Количество пар (data1, data2, score) в одном пакете iter_matches
+MATCH_BATCH_SIZE = 1000
+
+# Через сколько строк data1 отправлять прогресс и проверять отмену
+PROGRESS_CHUNK_ROWS = 100
+
+# Верхняя граница ширины блока строк data1
+MAX_CHUNK_ROWS = 1000
+
+# До этого числа пар (data1 x data2) планировщик сразу выбирает полный перебор
+PLANNER_MIN_PAIRS = 2_000_000
+
+# Размеры выборки строк data1 и data2 для замера стоимости способов поиска
+PLANNER_SAMPLE_QUERIES = 50
+PLANNER_SAMPLE_CHOICES = 20000
+
+class ProgressInfo(NamedTuple):
+    """Состояние выполнения сравнения, передаваемое в callback прогресса."""
+    stage: str              # 'reading', 'cleaning', 'planning', 'matching', 'writing', 'done'
+    rows_done: int          # обработано строк data1
+    rows_total: int         # всего строк data1 (0, если еще неизвестно)
+    pairs_scored: int       # сколько пар (data1, data2) оценено скорером
+    pairs_per_sec: float    # скорость сравнения на этапе 'matching'
+
+ProgressCallback = Callable[[ProgressInfo], None]
+
+class EnginePlan(NamedTuple):
+    """Решение планировщика: способ поиска и оценки времени по всем способам."""
+    engine: str                   # ключ из engines.ENGINES
+    estimates: Dict[str, float]   # оценка полного времени поиска, сек
+    reason: str
+
+class RunSummary:
+    """Итоги запуска сравнения."""
+    
+    def __init__(self) -> None:
+        self.rows_total = 0
+        self.rows_done = 0
+        self.pairs_found = 0
+        self.output_file = ''
+        self.output_parts = 1
+        self.output_layout = 'long'
+        self.output_rows = 0
+        self.excel_overflow = 'sheets'
+        self.reference_snapshot = ''
+        self.reference_size = 0
+        self.unprocessed_rows = 0
+        self.elapsed_sec = 0.0
+        self.max_memory_mb = 0.0
+        self.memory_ceiling_exceeded = False
+        self.chunk_rows = 0
+        self.stream_chunk_rows = 0
+        self.legal_form_mismatches = 0
+        self.peak_rss_mb: Optional[float] = None
+        self.plan: Optional[EnginePlan] = None
+        self.memory_cache_hits = 0
+        self.memory_cache_misses = 0
+        self.memory_cache_evictions = 0
+        self.disk_cache_hits = 0
+        self.disk_cache_misses = 0
+        self.background_writer = False
+        self.matching_blocked_sec = 0.0
+        self.writer_blocked_sec = 0.0
+    
+    def as_text(self) -> str:
+        lines = [f"Обработано строк data1: {self.rows_done} из {self.rows_total}",
+                 f"Найдено пар: {self.pairs_found}",
+                 f"Время: {self.elapsed_sec:.1f} сек"]
+        if self.unprocessed_rows:
+            lines.append(f"Не обработано строк: {self.unprocessed_rows}")
+        if self.legal_form_mismatches:
+            lines.append(f"Отклонено пар с разными ОПФ: {self.legal_form_mismatches}")
+        if self.output_layout == 'wide':
+            lines.append(f"Строк в файле результатов: {self.output_rows} (по одной на data1)")
+        if self.output_parts > 1:
+            unit = "листов" if self.excel_overflow == 'sheets' else "файлов"
+            lines.append(f"Результаты разбиты по пределу строк листа Excel, {unit}: {self.output_parts}")
+        for title, hits, misses in (("Кэш очистки в памяти", self.memory_cache_hits, self.memory_cache_misses),
+                                    ("Кэш очистки на диске", self.disk_cache_hits, self.disk_cache_misses)):
+            if hits or misses:
+                lines.append(f"{title}: найдено {hits} из {hits + misses} ({hits / (hits + misses):.0%})")
+        if self.memory_cache_evictions:
+            lines.append(f"Вытеснено из кэша в памяти: {self.memory_cache_evictions}")
+        if self.reference_snapshot:
+            action = "загружен из снимка" if self.reference_snapshot == 'loaded' else "сохранен в снимок"
+            lines.append(f"Справочник data2 ({self.reference_size} очищенных значений) {action} "
+                         f"{NAME_REFERENCE_SNAPSHOT}")
+        if self.plan is not None:
+            lines.append(f"Способ поиска: {self.plan.engine} ({self.plan.reason})")
+            if self.plan.estimates:
+                estimates = ", ".join(f"{name} {seconds:.1f} сек" for name, seconds in
+                                      sorted(self.plan.estimates.items(), key=lambda item: item[1]))
+                lines.append(f"Оценки: {estimates}")
+        if self.max_memory_mb:
+            lines.append(f"Ограничение памяти: {self.max_memory_mb:.0f} МБ, блок {self.chunk_rows} строк")
+            if self.stream_chunk_rows:
+                lines.append(f"data1 читается блоками по {self.stream_chunk_rows} строк")
+        if self.memory_ceiling_exceeded:
+            peak = f"{self.peak_rss_mb:.0f} МБ" if self.peak_rss_mb is not None else "неизвестна"
+            lines.append(f"Потолок памяти {self.max_memory_mb:.0f} МБ превышен, пиковая память {peak}")
+        if self.background_writer:
+            lines.append(f"Простой сравнения в ожидании записи: {self.matching_blocked_sec:.1f} сек, "
+                         f"простой записи в ожидании результатов: {self.writer_blocked_sec:.1f} сек")
+        if self.peak_rss_mb is not None:
+            lines.append(f"Пиковая память: {self.peak_rss_mb:.0f} МБ")
+        return "\n".join(lines)
+
+class CancellationToken:
+    """
+    Кооперативная отмена: сравнение проверяет токен между блоками строк
+    и прерывается исключением Comparison_cancelled_Error.
+    """
+    
+    def __init__(self) -> None:
+        self._event = threading.Event()
+    
+    def cancel(self) -> None:
+        self._event.set()
+    
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+    
+    def raise_if_cancelled(self) -> None:
+        if self._event.is_set():
+            raise Comparison_cancelled_Error()
+
+class _ProgressReporter:
+    """Считает скорость сравнения и передает ProgressInfo в callback."""
+    
+    def __init__(self, callback: Optional[ProgressCallback], cancel_token: Optional[CancellationToken]) -> None:
+        self.callback = callback
+        self.cancel_token = cancel_token
+        self.rows_done = 0
+        self.rows_total = 0
+        self.pairs_scored = 0
+        self.started_at = time.perf_counter()
+        self.finished_at: Optional[float] = None
+        self.current_stage = ''
+        self.summary = RunSummary()
+    
+    def stage(self, stage: str) -> None:
+        if self.cancel_token is not None:
+            self.cancel_token.raise_if_cancelled()
+        if stage == 'matching':
+            self.started_at = time.perf_counter()
+            self.finished_at = None
+        elif self.current_stage == 'matching':
+            # Скорость фиксируется по окончании этапа сравнения
+            self.finished_at = time.perf_counter()
+        self.current_stage = stage
+        self.report(stage)
+    
+    def report(self, stage: str = 'matching') -> None:
+        if self.callback is None:
+            return
+        elapsed = (self.finished_at or time.perf_counter()) - self.started_at
+        pairs_per_sec = self.pairs_scored / elapsed if elapsed > 0 else 0.0
+        self.callback(ProgressInfo(stage, self.rows_done, self.rows_total,
+                                   self.pairs_scored, pairs_per_sec))
+    
+    def chunk_done(self) -> None:
+        """Вызывается между блоками строк: отчет о прогрессе и проверка отмены."""
+        self.report()
+        if self.cancel_token is not None:
+            self.cancel_token.raise_if_cancelled()
+
+def _refresh_cleaners() -> str:
+    """
+    Пересобирает функции очистки и перенастраивает кэш при смене отпечатка
+    настроек очистки. Отпечаток меняется не только с конфигурацией, но и с
+    файлом сокращений (abbreviations_file), поэтому сравнивается он, а не
+    объект конфигурации. Возвращает отпечаток, под который собраны функции.
+    """
+    global _cleaner, _batch_cleaner, _cleaner_fingerprint
+    config = load_config()
+    fingerprint = cleaning_fingerprint(config)
+    with _cleaners_lock:
+        if _cleaner is None or fingerprint != _cleaner_fingerprint:
+            _cleaner = build_cleaner(config, legal_forms=True)
+            _batch_cleaner = build_batch_cleaner(config, legal_forms=True)
+            _cleaner_fingerprint = fingerprint
+            _cleaning_cache.configure(fingerprint,
+                                      int(config.get("cache_options", {}).get("memory_entries", 200_000)))
+    return fingerprint
+
+def _get_cleaner() -> Callable[[str], CleanedName]:
+    _refresh_cleaners()
+    return _cleaner
 
 def clean_company_name(company_name: str) -> str:
     """
     Оптимизированная функция очистки названия компании с использованием 
     опциональных параметров из конфигурационного файла.
+    Результат уже нормализован для rapidfuzz (см. utils.build_cleaner).
     """
-    if company_name in _cleaning_cache:
-        return _cleaning_cache[company_name]
+    cleaner = _get_cleaner()
+    cleaned = _cleaning_cache.get(company_name)
+    if cleaned is not None:
+        return cleaned.cleaned
     
-    # Загружаем конфигурацию
-    config = load_config()
+    # Используем функцию очистки, специализированную под конфигурацию
+    cleaned = cleaner(company_name)
+    
+    _cleaning_cache.put(company_name, cleaned)
+    return cleaned.cleaned
+
+def clean_company_names(company_names: Sequence[str],
+                        disk_cache: Optional[PersistentCleaningCache] = None,
+                        memory_cache: bool = True) -> List[CleanedName]:
+    """
+    Пакетная очистка списка названий: значения, которых нет в кэше, очищаются
+    одним вызовом utils.build_batch_cleaner (лемматизация по словарю уникальных слов).
+    Для каждого названия возвращается очищенный текст и найденные в нем ОПФ
+    (CleanedName); в кэшах они хранятся вместе.
+    Если передан disk_cache, сначала проверяется он, а новые результаты сохраняются в него.
+    memory_cache=False не пополняет кэш в памяти (потоковый режим: строки data1
+    проходят один раз, и кэш только занимал бы память).
+    """
+    fingerprint = _refresh_cleaners()
+    if disk_cache is not None and disk_cache.fingerprint != fingerprint:
+        # Настройки очистки изменились после открытия кэша на диске: его
+        # записи (и новые результаты) относятся к другому отпечатку
+        disk_cache = None
+    unique_names = list(dict.fromkeys(company_names))
+    # Результат собирается в локальном словаре: при малой емкости LRU-кэш
+    # может вытеснить часть записей еще до конца этой функции
+    result = _cleaning_cache.get_many(unique_names)
+    missing = [name for name in unique_names if name not in result]
+    if missing and disk_cache is not None:
+        found = disk_cache.get_many(missing)
+        if memory_cache:
+            _cleaning_cache.put_many(found)
+        result.update(found)
+        missing = [name for name in missing if name not in found]
+    if missing:
+        cleaned = dict(zip(missing, _batch_cleaner(missing)))
+        if memory_cache:
+            _cleaning_cache.put_many(cleaned)
+        result.update(cleaned)
+        if disk_cache is not None:
+            disk_cache.put_many(cleaned)
+    return [result[name] for name in company_names]
+
+def _open_disk_cache(config: Dict, max_memory_mb: float = 0) -> Optional[PersistentCleaningCache]:
+    """
+    Открывает постоянный кэш очистки в working_files, если он включен в настройках.
+    В режиме ограничения памяти файл кэша читается без mmap: отображенные
+    страницы считаются в резидентной памяти и съедают бюджет.
+    """
+    cache_options = config.get("cache_options", {})
+    if cache_options.get("persistent_cache", 1) != 1:
+        return None
+    os.makedirs(WORKING_DIR, exist_ok=True)
+    return PersistentCleaningCache(os.path.join(WORKING_DIR, NAME_CACHE_FILE),
+                                   cleaning_fingerprint(config),
+                                   int(cache_options.get("max_entries", 1_000_000)),
+                                   mmap_bytes=0 if max_memory_mb else CACHE_MMAP_BYTES)
+
+def _order_by_value(rows: List[Tuple], b_cleaned_to_original: Dict[str, List[str]],
+                    processed_b: Sequence[str], similarity_criterion: int) -> List[Tuple]:
+    """
+    Упорядочивает строки data1 так, чтобы первыми шли самые "выгодные":
+    сначала строки с точным совпадением в data2, затем строки с наименьшим
+    числом кандидатов, подходящих по длине.
+    """
+    b_lengths = sorted(len(x) for x in processed_b)
     
-    # Используем оптимизированную функцию очистки
-    normalized_words: str = clean_text_optimized(company_name, config)
+    def value_key(row: Tuple) -> Tuple[int, int]:
+        exact = 0 if row.cleaned in b_cleaned_to_original else 1
+        low, high = length_bounds(len(row.cleaned), similarity_criterion)
+        candidates = bisect.bisect_right(b_lengths, high) - bisect.bisect_left(b_lengths, low)
+        return exact, candidates
     
-    _cleaning_cache[company_name] = normalized_words
-    return normalized_words
+    return sorted(rows, key=value_key)
 
-def create_file_matches(similarity_criterion: int) -> None:
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    file_path = os.path.join(script_dir, "working_files", NAME_DATA_FILE)
+def plan_engine(queries: Sequence[str], processed_b: Sequence[str], scorer: Callable,
+                similarity_criterion: int, engine: str = 'auto',
+                rows_total: Optional[int] = None) -> EnginePlan:
+    """
+    Выбирает самый дешевый способ поиска из engines.ENGINES.
+    
+    queries - строки data1 (или их выборка, тогда rows_total - полное число
+    строк data1). Каждый способ строится на случайной выборке data2 и
+    прогоняется на выборке data1; замеренное время масштабируется на полный объем.
+    Так в оценке учитываются распределение длин строк, порог, скорер и
+    число ядер (для cdist), без отдельной модели для каждого фактора.
+    """
+    if rows_total is None:
+        rows_total = len(queries)
+    if engine != 'auto':
+        return EnginePlan(engine, {}, 'задан в настройках')
+    if not queries or rows_total * len(processed_b) <= PLANNER_MIN_PAIRS:
+        return EnginePlan('brute', {}, 'небольшой объем данных')
+    
+    rng = random.Random(0)
+    sample_b = rng.sample(list(processed_b), min(len(processed_b), PLANNER_SAMPLE_CHOICES))
+    sample_queries = rng.sample(list(queries), min(len(queries), PLANNER_SAMPLE_QUERIES))
+    scale = len(processed_b) / len(sample_b)
+    
+    estimates = {}
+    for name, engine_class in ENGINES.items():
+        started = time.perf_counter()
+        sample_engine = engine_class(sample_b, scorer, similarity_criterion)
+        build_time = time.perf_counter() - started
+        
+        started = time.perf_counter()
+        sample_engine.match(sample_queries)
+        query_time = (time.perf_counter() - started) / len(sample_queries)
+        
+        estimates[name] = (build_time + query_time * rows_total) * scale
+    
+    best = min(estimates, key=estimates.get)
+    lengths = sorted(len(x) for x in sample_b)
+    reason = (f"{rows_total} x {len(processed_b)} строк, медиана длины {lengths[len(lengths) // 2]}, "
+              f"порог {similarity_criterion}%, {scorer.__name__}, ядер {os.cpu_count()}")
+    return EnginePlan(best, estimates, reason)
+
+def read_unprocessed_rows() -> List[str]:
+    """Читает список строк data1, не обработанных в прошлом запуске с ограничением времени."""
+    file_path = os.path.join(WORKING_DIR, NAME_UNPROCESSED_FILE)
+    if not os.path.isfile(file_path):
+        return []
+    # Как и исходные данные, читается строками, чтобы значения совпали с data1
+    return read_data_columns(file_path, columns=['data1'])['data1'].dropna().tolist()
+
+def iter_matches(similarity_criterion: int,
+                 batch_size: int = MATCH_BATCH_SIZE,
+                 progress_callback: Optional[ProgressCallback] = None,
+                 cancel_token: Optional[CancellationToken] = None,
+                 time_budget: Optional[float] = None,
+                 data1_subset: Optional[Iterable[str]] = None,
+                 unprocessed: Optional[List[str]] = None,
+                 max_memory_mb: float = 0,
+                 data_file: Optional[str] = None,
+                 engine: Optional[str] = None,
+                 data: Optional[pd.DataFrame] = None,
+                 stream_chunk_rows: int = 0,
+                 reference_file: Optional[str] = None) -> Iterator[MatchBatch]:
+    """
+    Генератор совпадений: выдает пакеты кортежей (data1, data2, score)
+    по мере их вычисления, не накапливая весь результат в памяти.
+    
+    progress_callback получает ProgressInfo на каждом этапе и после каждого
+    блока из PROGRESS_CHUNK_ROWS строк; cancel_token проверяется там же.
+    
+    time_budget (секунды) включает режим ограничения времени: строки data1
+    обрабатываются в порядке убывания пользы, а по истечении времени
+    генератор останавливается и дописывает необработанные строки в
+    unprocessed. data1_subset ограничивает data1 заданными значениями
+    (например, для продолжения прерванного запуска).
+    
+    max_memory_mb включает режим ограничения памяти: ширина блока строк
+    подбирается по свободному до потолка объему, а пары дедуплицируются
+    через разделы на диске (порядок пар при этом не сохраняется). Без data
+    и time_budget data1 при этом читается потоково, блоками по бюджету
+    (memory.budget_chunk_rows), как при stream_chunk_rows.
+    
+    data_file - путь к исходному файлу xlsx, CSV, Parquet или Arrow IPC (по
+    умолчанию из input_options конфигурации, иначе working_files/NAME_DATA_FILE).
+    data - уже прочитанные исходные данные (столбцы data1 и data2, например из
+    readers.read_input_data); если заданы, файл не читается.
+    
+    engine - способ поиска из engines.ENGINES или 'auto' (выбор планировщиком
+    plan_engine); по умолчанию берется comparison_options.engine.
+    
+    stream_chunk_rows включает потоковый режим для очень большого data1:
+    data1 читается из data_file блоками по stream_chunk_rows строк, а data2
+    (из reference_file или того же файла) загружается и индексируется один
+    раз (см. _iter_streamed_matches). С data этот режим не используется.
+    """
+    progress = _ProgressReporter(progress_callback, cancel_token)
+    return _iter_matches(similarity_criterion, batch_size, progress,
+                         time_budget, data1_subset, unprocessed, max_memory_mb, data_file, engine, data,
+                         stream_chunk_rows, reference_file)
+
+def _iter_matches(similarity_criterion: int, batch_size: int, progress: _ProgressReporter,
+                  time_budget: Optional[float] = None,
+                  data1_subset: Optional[Iterable[str]] = None,
+                  unprocessed: Optional[List[str]] = None,
+                  max_memory_mb: float = 0,
+                  data_file: Optional[str] = None,
+                  engine: Optional[str] = None,
+                  data: Optional[pd.DataFrame] = None,
+                  stream_chunk_rows: int = 0,
+                  reference_file: Optional[str] = None,
+                  spilled: bool = False) -> Iterator[MatchBatch]:
+    if data_file is None:
+        data_file = data_file_path(load_config())
+    
+    if max_memory_mb and not spilled:
+        # Разделы пишутся рядом с исходными данными
+        deduplicator = SpillDeduplicator(max_memory_mb, batch_size, os.path.dirname(os.path.abspath(data_file)))
+        batches = _iter_matches(similarity_criterion, batch_size, progress,
+                                time_budget, data1_subset, unprocessed, max_memory_mb, data_file, engine,
+                                data, stream_chunk_rows, reference_file, spilled=True)
+        yield from deduplicator.dedupe(batches)
+        return
+    
+    if max_memory_mb and not stream_chunk_rows and data is None and not time_budget:
+        # С потолком памяти data1 не загружается целиком: объем памяти не должен
+        # зависеть от числа строк data1, поэтому он читается блоками по бюджету
+        stream_chunk_rows = budget_chunk_rows(max_memory_mb)
+        progress.summary.stream_chunk_rows = stream_chunk_rows
+    
+    if stream_chunk_rows and data is None:
+        yield from _iter_streamed_matches(similarity_criterion, batch_size, progress, data1_subset,
+                                          max_memory_mb, data_file, reference_file, engine, stream_chunk_rows)
+        return
     
-    df_data: pd.DataFrame = pd.read_excel(file_path)
+    # Бюджет времени отсчитывается с начала запуска, включая чтение и очистку
+    deadline = time.monotonic() + time_budget if time_budget else None
+    progress.stage('reading')
+    
+    # Данные, прочитанные и проверенные вызывающим кодом, повторно не читаются
+    df_data: pd.DataFrame = data if data is not None else read_data_columns(data_file)
     # Оптимизация: работа с данными без копирования
     df_data_a = df_data[['data1']].dropna().drop_duplicates()
     df_data_b = df_data[['data2']].dropna().drop_duplicates()
+    del df_data
+    if data1_subset is not None:
+        df_data_a = df_data_a[df_data_a['data1'].isin(set(data1_subset))]
     
     # Векторизованная очистка данных
     df_data_a = df_data_a.copy()
     df_data_b = df_data_b.copy()
     
-    # Очистка данных с использованием новой функции
-    df_data_a['cleaned'] = df_data_a['data1'].apply(clean_company_name)
-    df_data_b['cleaned'] = df_data_b['data2'].apply(clean_company_name)
+    progress.rows_total = len(df_data_a)
     
-    # Создаем словарь для быстрого поиска
-    b_cleaned_to_original = defaultdict(list)
-    for idx, row in df_data_b.iterrows():
-        b_cleaned_to_original[row['cleaned']].append(row['data2'])
+    config = load_config()
+    disk_cache = _open_disk_cache(config, max_memory_mb)
+    try:
+        progress.stage('cleaning')
+        counters = (_cleaning_cache.hits, _cleaning_cache.misses, _cleaning_cache.evictions)
+        # Очистка обоих столбцов одним пакетом: общий словарь лемм
+        cleaned = clean_company_names(df_data_a['data1'].tolist() + df_data_b['data2'].tolist(), disk_cache)
+        _record_cache_stats(progress.summary, counters, disk_cache)
+        if disk_cache is not None:
+            disk_cache.close()
+            disk_cache = None
+        df_data_a['cleaned'] = [name.cleaned for name in cleaned[:len(df_data_a)]]
+        df_data_a['legal_forms'] = [name.legal_forms for name in cleaned[:len(df_data_a)]]
+        
+        # Создаем словарь для быстрого поиска
+        b_cleaned_to_original, b_legal_forms = _reference_map(df_data_b['data2'].tolist(), cleaned[len(df_data_a):])
+        del cleaned
+        
+        # Очищенные строки уже нормализованы для rapidfuzz
+        processed_b = list(b_cleaned_to_original.keys())
+        
+        scorer = _scorer(config)
+        
+        rows = list(df_data_a.itertuples(index=False))
+        if deadline is not None:
+            rows = _order_by_value(rows, b_cleaned_to_original, processed_b, similarity_criterion)
+        
+        # Выбираем способ поиска и ширину блока строк data1
+        progress.stage('planning')
+        if engine is None:
+            engine = config.get("comparison_options", {}).get("engine", "auto")
+        sample_rows = random.Random(0).sample(rows, min(len(rows), PLANNER_SAMPLE_QUERIES))
+        plan = plan_engine([row.cleaned for row in sample_rows],
+                           processed_b, scorer, similarity_criterion, engine, rows_total=len(rows))
+        progress.summary.plan = plan
+        matcher, batch_size, chunk_rows = _build_matcher(plan, processed_b, scorer, similarity_criterion,
+                                                         max_memory_mb, batch_size, progress.summary)
+        
+        progress.stage('matching')
+        batch = yield from _match_rows(rows, matcher, list(b_cleaned_to_original.values()), chunk_rows,
+                                       batch_size, progress, deadline=deadline, unprocessed=unprocessed,
+                                       b_legal_forms=list(b_legal_forms.values()).__getitem__
+                                       if _matches_legal_forms(config) else None)
+        
+        progress.report()
+        if batch:
+            yield batch
+    finally:
+        if disk_cache is not None:
+            disk_cache.close()
+
+class _QueryRow(NamedTuple):
+    """Строка data1, ее очищенное значение и найденные ОПФ."""
+    data1: str
+    cleaned: str
+    legal_forms: LegalForms
 
-    b_cleaned_list = list(b_cleaned_to_original.keys())
+class _SeenValues:
+    """
+    Значения data1, уже встреченные в прошлых блоках потокового режима.
+    Хранятся не сами строки, а отсортированный массив их 64-битных хэшей
+    (8 байт на уникальное значение); совпадение хэшей у разных строк при
+    миллионах значений практически исключено (вероятность порядка n^2 / 2^65).
+    """
     
-    # Предварительная обработка для rapidfuzz
-    processed_b = [utils.default_process(x) for x in b_cleaned_list]
+    def __init__(self) -> None:
+        self._hashes = np.empty(0, dtype=np.uint64)
     
-    results = []
+    def new_values(self, values: List[str]) -> List[str]:
+        """Оставляет значения, которых не было раньше, и запоминает их (values без повторов)."""
+        if not values:
+            return values
+        hashes = pd.util.hash_array(np.array(values, dtype=object))
+        positions = np.searchsorted(self._hashes, hashes)
+        seen = positions < len(self._hashes)
+        seen[seen] = self._hashes[positions[seen]] == hashes[seen]
+        if seen.any():
+            values = [value for value, is_seen in zip(values, seen) if not is_seen]
+            hashes = hashes[~seen]
+        hashes.sort()
+        self._hashes = np.insert(self._hashes, np.searchsorted(self._hashes, hashes), hashes)
+        return values
+
+def _iter_streamed_matches(similarity_criterion: int, batch_size: int, progress: _ProgressReporter,
+                           data1_subset: Optional[Iterable[str]], max_memory_mb: float,
+                           data_file: str, reference_file: Optional[str], engine: Optional[str],
+                           stream_chunk_rows: int) -> Iterator[MatchBatch]:
+    """
+    Потоковый режим для data1, не помещающегося в память: data2 читается,
+    очищается и индексируется один раз, а data1 читается блоками по
+    stream_chunk_rows строк (readers.iter_column_chunks). Каждый блок
+    очищается, сравнивается и уходит на запись до чтения следующего, поэтому
+    память определяется размером блока и data2, а не числом строк data1.
+    
+    data2 берется из reference_file, если он задан, иначе из того же файла;
+    очищенный справочник сохраняется в снимок и при следующих запусках
+    берется из него (см. _load_reference).
+    Повторы data1 убираются и внутри блока, и между блоками (_SeenValues):
+    значение, встреченное раньше, повторно не очищается и не сравнивается,
+    поэтому результат совпадает с обычным режимом. Планировщик получает
+    оценку числа строк data1 по всему файлу (readers.estimate_rows), а не
+    размер первого блока. Ограничение времени в этом режиме не применяется:
+    порядок строк по пользе требует всех строк data1 сразу.
+    """
+    progress.stage('reading')
+    progress.rows_total = count_rows(data_file)
+    subset = set(data1_subset) if data1_subset is not None else None
+    seen = _SeenValues()
     
-    # Загружаем конфигурацию для выбора метрики
     config = load_config()
-    use_token_sort = config.get("comparison_options", {}).get("use_token_sort_ratio", 0) == 1
+    disk_cache = _open_disk_cache(config, max_memory_mb)
+    try:
+        counters = (_cleaning_cache.hits, _cleaning_cache.misses, _cleaning_cache.evictions)
+        processed_b, b_originals, b_legal_forms = _load_reference(reference_file or data_file, stream_chunk_rows,
+                                                                  config, disk_cache, progress)
+        if not _matches_legal_forms(config):
+            b_legal_forms = None
+        scorer = _scorer(config)
+        if engine is None:
+            engine = config.get("comparison_options", {}).get("engine", "auto")
+        
+        matcher = None
+        chunk_rows = 0
+        batch: MatchBatch = []
+        rows_done = 0
+        for values in iter_column_chunks(data_file, 'data1', stream_chunk_rows):
+            values = list(dict.fromkeys(values))
+            if subset is not None:
+                values = [value for value in values if value in subset]
+            values = seen.new_values(values)
+            rows = [_QueryRow(value, *name) for value, name in
+                    zip(values, clean_company_names(values, disk_cache, memory_cache=False))]
+            if not rows:
+                continue
+            
+            if matcher is None:
+                # Способ поиска выбирается по первому блоку, индекс data2 строится один раз
+                progress.stage('planning')
+                rows_estimate = estimate_rows(data_file)
+                if subset is not None:
+                    rows_estimate = min(rows_estimate, len(subset))
+                sample_rows = random.Random(0).sample(rows, min(len(rows), PLANNER_SAMPLE_QUERIES))
+                plan = plan_engine([row.cleaned for row in sample_rows], processed_b, scorer,
+                                   similarity_criterion, engine, rows_total=max(rows_estimate, len(rows)))
+                progress.summary.plan = plan
+                matcher, batch_size, chunk_rows = _build_matcher(plan, processed_b, scorer, similarity_criterion,
+                                                                 max_memory_mb, batch_size, progress.summary)
+                progress.stage('matching')
+            
+            batch = yield from _match_rows(rows, matcher, b_originals, chunk_rows, batch_size, progress,
+                                           batch=batch, rows_offset=rows_done, b_legal_forms=b_legal_forms)
+            rows_done += len(rows)
+        
+        # Точное число строк известно только после чтения всего файла
+        progress.rows_total = rows_done
+        progress.report()
+        if batch:
+            yield batch
+        _record_cache_stats(progress.summary, counters, disk_cache)
+    finally:
+        if disk_cache is not None:
+            disk_cache.close()
+
+def _record_cache_stats(summary: RunSummary, counters: Tuple[int, int, int],
+                        disk_cache: Optional[PersistentCleaningCache]) -> None:
+    """Переносит в итоги статистику кэшей очистки с момента counters."""
+    summary.memory_cache_hits = _cleaning_cache.hits - counters[0]
+    summary.memory_cache_misses = _cleaning_cache.misses - counters[1]
+    summary.memory_cache_evictions = _cleaning_cache.evictions - counters[2]
+    if disk_cache is not None:
+        summary.disk_cache_hits = disk_cache.hits
+        summary.disk_cache_misses = disk_cache.misses
+
+def _reference_map(values: Sequence[str],
+                   cleaned: Sequence[CleanedName]) -> Tuple[Dict[str, List[str]], Dict[str, List[LegalForms]]]:
+    """
+    Очищенная строка data2 -> исходные значения data2 с такой очисткой и
+    очищенная строка -> ОПФ этих значений (в том же порядке).
+    """
+    b_cleaned_to_original: Dict[str, List[str]] = defaultdict(list)
+    b_legal_forms: Dict[str, List[LegalForms]] = defaultdict(list)
+    for value, (cleaned_value, legal_forms) in zip(values, cleaned):
+        b_cleaned_to_original[cleaned_value].append(value)
+        b_legal_forms[cleaned_value].append(legal_forms)
+    return b_cleaned_to_original, b_legal_forms
+
+def _matches_legal_forms(config: Dict) -> bool:
+    """Пары с разными ОПФ отклоняются (comparison_options.match_legal_forms)."""
+    return config.get("comparison_options", {}).get("match_legal_forms", 0) == 1
+
+def _load_reference(file_path: str, chunk_rows: int, config: Dict,
+                    disk_cache: Optional[PersistentCleaningCache],
+                    progress: _ProgressReporter,
+                    snapshot_path: Optional[str] = None
+                    ) -> Tuple[Sequence[str], Sequence[List[str]], Callable[[int], List[LegalForms]]]:
+    """
+    Справочник data2 для потокового режима: уникальные очищенные значения
+    (по ним строится индекс поиска), для каждого - исходные значения и
+    функция, возвращающая по номеру очищенного значения ОПФ исходных.
     
-    # Выбираем скорер
-    scorer = fuzz.token_sort_ratio if use_token_sort else fuzz.ratio
+    При cache_options.reference_snapshot = 1 справочник, пока не изменились
+    файл и настройки очистки, берется из снимка Arrow IPC в working_files
+    (cache.ReferenceSnapshot): файл не читается и не очищается, а исходные
+    значения остаются в отображенном в память файле, общем для процессов.
+    Иначе столбец data2 читается и очищается, и снимок пересохраняется.
+    snapshot_path - путь снимка, по умолчанию working_files/NAME_REFERENCE_SNAPSHOT.
+    """
+    if config.get("cache_options", {}).get("reference_snapshot", 1) != 1:
+        snapshot_path = None
+    elif snapshot_path is None:
+        snapshot_path = os.path.join(WORKING_DIR, NAME_REFERENCE_SNAPSHOT)
+    if snapshot_path is not None:
+        key = snapshot_key(file_path, cleaning_fingerprint(config))
+        snapshot = ReferenceSnapshot.open(snapshot_path, key)
+        if snapshot is not None:
+            progress.summary.reference_snapshot = 'loaded'
+            progress.summary.reference_size = len(snapshot)
+            return snapshot.cleaned_values(), snapshot, snapshot.legal_forms_at
     
-    for idx, row in enumerate(df_data_a.itertuples(), 1):
-        cleaned_a = row.cleaned
-        processed_a = utils.default_process(cleaned_a)
-        
-        # Используем rapidfuzz с выбранным скорером
-        matches = process.extract(
-            processed_a, 
-            processed_b, 
-            scorer=scorer, # Используем выбранный скорер
-            score_cutoff=similarity_criterion,
-            limit=50  # Ограничиваем количество результатов
-        )
+    values = list(dict.fromkeys(value for chunk in iter_column_chunks(file_path, 'data2', chunk_rows)
+                                for value in chunk))
+    progress.stage('cleaning')
+    reference, legal_forms = _reference_map(values, clean_company_names(values, disk_cache))
+    del values
+    if snapshot_path is not None:
+        os.makedirs(os.path.dirname(snapshot_path), exist_ok=True)
+        if ReferenceSnapshot.save(snapshot_path, key, reference, legal_forms):
+            progress.summary.reference_snapshot = 'saved'
+            progress.summary.reference_size = len(reference)
+    return list(reference.keys()), list(reference.values()), list(legal_forms.values()).__getitem__
+
+def _scorer(config: Dict) -> Callable:
+    # Метрика выбирается по конфигурации
+    use_token_sort = config.get("comparison_options", {}).get("use_token_sort_ratio", 0) == 1
+    return fuzz.token_sort_ratio if use_token_sort else fuzz.ratio
+
+def _build_matcher(plan: EnginePlan, processed_b: Sequence[str], scorer: Callable,
+                   similarity_criterion: int, max_memory_mb: float, batch_size: int,
+                   summary: RunSummary) -> Tuple[BruteForceEngine, int, int]:
+    """
+    Строит индекс data2 выбранным способом поиска и подбирает размер пакета
+    пар и ширину блока строк data1. Возвращает (matcher, batch_size, chunk_rows).
+    """
+    if max_memory_mb:
+        used_mb = current_rss_mb()
+        if used_mb is not None and used_mb >= max_memory_mb:
+            # Данные и библиотеки уже заняли больше потолка: соблюсти его нельзя,
+            # сравнение идет с минимальным бюджетом (memory.MIN_BUDGET_BYTES)
+            summary.memory_ceiling_exceeded = True
+        budget = available_budget_bytes(max_memory_mb)
+        # Половина свободного бюджета - под матрицу оценок cdist,
+        # четверть - под накопленные пары до сброса на диск
+        batch_size = int(min(batch_size, max(budget // 4 // PAIR_SIZE_BYTES, 1)))
+        summary.max_memory_mb = max_memory_mb
+    if plan.engine == CdistEngine.name:
+        block_bytes = min(CDIST_BLOCK_BYTES, max(budget // 2, 1)) if max_memory_mb else CDIST_BLOCK_BYTES
+        matcher = CdistEngine(processed_b, scorer, similarity_criterion, block_bytes=block_bytes)
+    else:
+        matcher = ENGINES[plan.engine](processed_b, scorer, similarity_criterion)
+    chunk_rows = min(matcher.block_rows(PROGRESS_CHUNK_ROWS), MAX_CHUNK_ROWS)
+    summary.chunk_rows = chunk_rows
+    return matcher, batch_size, chunk_rows
+
+def _match_rows(rows: Sequence[Tuple], matcher: BruteForceEngine, b_originals: Sequence[List[str]],
+                chunk_rows: int, batch_size: int,
+                progress: _ProgressReporter, batch: Optional[MatchBatch] = None,
+                rows_offset: int = 0, deadline: Optional[float] = None,
+                unprocessed: Optional[List[str]] = None,
+                b_legal_forms: Optional[Callable[[int], List[LegalForms]]] = None) -> Iterator[MatchBatch]:
+    """
+    Сравнивает строки data1 блоками по chunk_rows и выдает полные пакеты пар.
+    b_originals[i] - исходные значения data2 для i-й очищенной строки индекса.
+    Если передан b_legal_forms (ОПФ этих значений по номеру i), пара
+    отклоняется, когда ОПФ найдены у обеих сторон и ни одна не совпадает:
+    "ООО Ромашка" и "АО Ромашка" - разные организации, даже если без форм
+    названия одинаковы. Строки rows тогда должны иметь поле legal_forms.
+    Возвращает (через yield from) неполный последний пакет, чтобы его
+    можно было дополнить следующими строками.
+    """
+    if batch is None:
+        batch = []
+    for start in range(0, len(rows), chunk_rows):
+        if deadline is not None and time.monotonic() >= deadline:
+            # Время вышло: остаток сохраняем для продолжения в следующем запуске
+            if unprocessed is not None:
+                unprocessed.extend(r.data1 for r in rows[start:])
+            break
         
-        matched_strings = []
-        for match_text, score, match_idx in matches:
-            if score >= similarity_criterion:
-                original_strings = b_cleaned_to_original[b_cleaned_list[match_idx]]
-                matched_strings.extend(original_strings)
+        chunk = rows[start:start + chunk_rows]
+        queries = [row.cleaned for row in chunk]
         
-        if matched_strings:
-            results.append({
-                'data1': row.data1,
-                'data2': matched_strings
-            })
+        # Пары уникальны: data1 и data2 дедуплицированы, а каждое исходное
+        # значение data2 относится ровно к одной очищенной строке
+        for row, matches in zip(chunk, matcher.match(queries)):
+            for score, match_idx in matches:
+                if b_legal_forms is not None and row.legal_forms:
+                    for original, legal_forms in zip(b_originals[match_idx], b_legal_forms(match_idx)):
+                        if legal_forms and set(row.legal_forms).isdisjoint(legal_forms):
+                            progress.summary.legal_form_mismatches += 1
+                        else:
+                            batch.append((row.data1, original, score))
+                    continue
+                for original in b_originals[match_idx]:
+                    batch.append((row.data1, original, score))
         
-    # Создаем финальный DataFrame одним действием
-    if results:
-        df_output = pd.DataFrame([
-            {'data1': result['data1'], 'data2': data2} 
-            for result in results 
-            for data2 in result['data2']
-        ]).drop_duplicates()
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
         
-        file_path = os.path.join(script_dir, "working_files", NAME_OUTPUT_FILE)
-        try:
-            df_output.to_excel(file_path, index=False)
-        except ValueError:
-            # pr_bar.update(progress=0, total=None)
-            # label_progress_bar.update(content = '')
-            raise Sheet_too_large_Error()
-        except PermissionError:
-            # pr_bar.update(progress=0, total=None)
-            # label_progress_bar.update(content = '')
-            raise PermissionError()
-            
-    else:
-        # Создаем пустой файл если нет результатов
-        file_path = os.path.join(script_dir, "working_files", NAME_OUTPUT_FILE)
-        pd.DataFrame(columns=['data1', 'data2']).to_excel(file_path, index=False)
+        progress.rows_done = rows_offset + start + len(chunk)
+        progress.pairs_scored += len(chunk) * len(b_originals)
+        progress.chunk_done()
+    return batch
+
+def _then_stage(batches: Iterable[MatchBatch], progress: _ProgressReporter, stage: str) -> Iterator[MatchBatch]:
+    """Пропускает пакеты насквозь и сообщает о новом этапе, когда они закончились."""
+    yield from batches
+    progress.stage(stage)
+
+def _previous_results(file_path: str) -> Iterator[MatchBatch]:
+    """
+    Выдает результаты прошлого (частичного) запуска одним пакетом. Значения
+    приводятся к строкам (Excel читает числа числами), пустая оценка - None.
+    """
+    if os.path.isfile(file_path):
+        df_previous = read_results(file_path)
+        if 'score' in df_previous.columns:
+            scores = [None if pd.isna(score) else float(score) for score in df_previous['score']]
+        else:
+            scores = [None] * len(df_previous)
+        batch = list(zip(df_previous['data1'].astype(str), df_previous['data2'].astype(str), scores))
+        if batch:
+            yield batch
 
-    # Очищаем кэш после использования
-    _cleaning_cache.clear()
\ No newline at end of file
+def create_file_matches(similarity_criterion: int,
+                        progress_callback: Optional[ProgressCallback] = None,
+                        cancel_token: Optional[CancellationToken] = None,
+                        time_budget: Optional[float] = None,
+                        resume: bool = False,
+                        max_memory_mb: Optional[float] = None,
+                        data: Optional[pd.DataFrame] = None,
+                        data_file: Optional[str] = None,
+                        output_file: Optional[str] = None,
+                        stream_chunk_rows: Optional[int] = None,
+                        reference_file: Optional[str] = None) -> RunSummary:
+    """
+    Сравнивает data1 и data2 и записывает результаты в NAME_OUTPUT_FILE.
+    
+    Формат исходных данных и результатов (xlsx, CSV, Parquet, Arrow IPC)
+    определяется по расширению data_file и output_file; по умолчанию пути
+    и форматы берутся из input_options и output_options конфигурации.
+    Раскладка строк результатов - output_options.layout ('long' или 'wide',
+    см. writers.result_columns).
+    
+    Если time_budget не задан, берется comparison_options.time_budget_sec
+    из конфигурации (0 - без ограничения). Строки, не обработанные до
+    истечения времени, записываются в NAME_UNPROCESSED_FILE; при resume=True
+    обрабатываются только они, а результаты дописываются к прошлым.
+    
+    Если max_memory_mb не задан, берется comparison_options.max_memory_mb
+    (0 - без ограничения памяти).
+    
+    data - исходные данные, уже прочитанные readers.read_input_data; без них
+    читается data_file.
+    
+    Если stream_chunk_rows не задан, берется comparison_options.stream_chunk_rows
+    (0 - data1 читается целиком), а если не задан reference_file -
+    input_options.reference_file. См. iter_matches.
+    
+    Возвращает итоги запуска RunSummary.
+    """
+    config = load_config()
+    file_path = output_file or output_file_path(config)
+    unprocessed_path = os.path.join(WORKING_DIR, NAME_UNPROCESSED_FILE)
+    
+    comparison_options = config.get("comparison_options", {})
+    if time_budget is None:
+        time_budget = float(comparison_options.get("time_budget_sec", 0))
+    if max_memory_mb is None:
+        max_memory_mb = float(comparison_options.get("max_memory_mb", 0))
+    if stream_chunk_rows is None:
+        stream_chunk_rows = int(comparison_options.get("stream_chunk_rows", 0))
+    if reference_file is None:
+        reference_file = reference_file_path(config)
+    
+    started_at = time.perf_counter()
+    data1_subset = read_unprocessed_rows() if resume else None
+    
+    progress = _ProgressReporter(progress_callback, cancel_token)
+    unprocessed: List[str] = []
+    batches = _iter_matches(similarity_criterion, MATCH_BATCH_SIZE, progress,
+                            time_budget, data1_subset, unprocessed, max_memory_mb, data_file, data=data,
+                            stream_chunk_rows=stream_chunk_rows, reference_file=reference_file)
+    if resume:
+        # Прошлые результаты читаются сразу: потоковые форматы (CSV, Parquet,
+        # Arrow) начинают перезаписывать файл еще до первого пакета
+        batches = itertools.chain(list(_previous_results(file_path)), batches)
+    
+    # Результаты записываются по мере поступления пакетов из генератора;
+    # при отсутствии совпадений создается пустой файл с заголовками
+    output_options = config.get("output_options", {})
+    row_group_rows = int(output_options.get("parquet_row_group_rows", PARQUET_ROW_GROUP_ROWS))
+    excel_overflow = output_options.get("excel_overflow", "sheets")
+    layout = output_options.get("layout", "long")
+    write = partial(write_results, file_path=file_path, row_group_rows=row_group_rows,
+                    excel_overflow=excel_overflow, layout=layout,
+                    max_matches=int(output_options.get("wide_max_matches", WIDE_MAX_MATCHES)))
+    batches = _then_stage(batches, progress, 'writing')
+    writer_queue_batches = int(output_options.get("writer_queue_batches", WRITER_QUEUE_BATCHES))
+    if writer_queue_batches:
+        # Запись в отдельном потоке идет одновременно со сравнением следующих строк
+        writer = BackgroundWriter(write, writer_queue_batches)
+        written = writer.run(batches)
+        progress.summary.matching_blocked_sec = writer.producer_blocked_sec
+        progress.summary.writer_blocked_sec = writer.consumer_blocked_sec
+        progress.summary.background_writer = True
+    else:
+        written = write(batches)
+    
+    if unprocessed:
+        write_unprocessed(unprocessed, unprocessed_path)
+    elif os.path.isfile(unprocessed_path):
+        # Все строки обработаны: список для продолжения больше не нужен
+        os.remove(unprocessed_path)
+    
+    progress.stage('done')
+    
+    summary = progress.summary
+    summary.rows_total = progress.rows_total
+    summary.rows_done = progress.rows_done
+    summary.pairs_found = written.pairs
+    summary.output_file = file_path
+    summary.output_rows = written.rows
+    if detect_format(file_path) != 'sqlite':
+        summary.output_layout = layout
+    if detect_format(file_path) == 'xlsx':
+        summary.excel_overflow = excel_overflow
+        summary.output_parts = excel_parts(written.rows)
+    summary.unprocessed_rows = len(unprocessed)
+    summary.elapsed_sec = time.perf_counter() - started_at
+    summary.peak_rss_mb = peak_rss_mb()
+    if max_memory_mb and summary.peak_rss_mb is not None and summary.peak_rss_mb > max_memory_mb:
+        summary.memory_ceiling_exceeded = True
+    return summary
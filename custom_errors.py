@@ -7,4 +7,12 @@ Created on Fri Nov 21 14:11:39 2025
 
 class Sheet_too_large_Error(Exception):
     """Данных больше, чем строк в excel"""
-    pass
\ No newline at end of file
+    pass
+
+class Comparison_cancelled_Error(Exception):
+    """Сравнение прервано пользователем"""
+    pass
+
+class Input_data_Error(Exception):
+    """Ошибка в исходных данных: нет файла или листа, неверные столбцы, пустая таблица"""
+    pass
@@ -0,0 +1,181 @@
+import bisect
+from collections import defaultdict
+from typing import Callable, Dict, List, Sequence, Tuple
+
+import numpy as np
+from rapidfuzz import process, fuzz
+
+# Максимум совпадений из data2 для одной строки data1
+MATCH_LIMIT = 50
+
+# Объем матрицы оценок process.cdist для одного блока строк, байт
+CDIST_BLOCK_BYTES = 64 * 2**20
+
+# Длина n-грамм в индексе NgramIndexEngine
+NGRAM_SIZE = 2
+
+# Совпадения одной строки data1: (score, индекс в processed_b)
+RowMatches = List[Tuple[float, int]]
+
+def length_bounds(length: int, similarity_criterion: float) -> Tuple[float, float]:
+    """
+    Допустимый диапазон длин строк data2 для строки data1 длины length.
+    Для нормализованного расстояния Indel (fuzz.ratio) схожесть не может
+    превышать 2 * min(la, lb) / (la + lb), поэтому более короткие или более
+    длинные строки заведомо не проходят порог.
+    """
+    t = similarity_criterion / 100
+    if t <= 0:
+        return 0, float('inf')
+    # Небольшой запас на погрешность вычислений с плавающей точкой
+    return length * t / (2 - t) - 1e-9, length * (2 - t) / t + 1e-9
+
+def _top_matches(scored: List[Tuple[float, int]]) -> RowMatches:
+    """MATCH_LIMIT лучших совпадений; при равной оценке - в порядке индексов, как у process.extract."""
+    scored.sort(key=lambda match: (-match[0], match[1]))
+    return scored[:MATCH_LIMIT]
+
+class BruteForceEngine:
+    """Полный перебор data2 для каждой строки через process.extract."""
+
+    name = 'brute'
+
+    def __init__(self, processed_b: Sequence[str], scorer: Callable, similarity_criterion: float) -> None:
+        self.processed_b = processed_b
+        self.scorer = scorer
+        self.similarity_criterion = similarity_criterion
+
+    def block_rows(self, default: int) -> int:
+        """Сколько строк data1 обрабатывать за один вызов match."""
+        return default
+
+    def match(self, queries: Sequence[str]) -> List[RowMatches]:
+        return [[(score, match_idx)
+                 for match_text, score, match_idx in process.extract(
+                     query,
+                     self.processed_b,
+                     scorer=self.scorer,
+                     score_cutoff=self.similarity_criterion,
+                     limit=MATCH_LIMIT)]
+                for query in queries]
+
+class CdistEngine(BruteForceEngine):
+    """
+    Полный перебор блоком строк через process.cdist на всех ядрах.
+    Матрица оценок занимает len(queries) * len(processed_b) * 8 байт,
+    поэтому ширина блока ограничена block_bytes.
+    """
+
+    name = 'cdist'
+
+    def __init__(self, processed_b: Sequence[str], scorer: Callable, similarity_criterion: float,
+                 workers: int = -1, block_bytes: int = CDIST_BLOCK_BYTES) -> None:
+        super().__init__(processed_b, scorer, similarity_criterion)
+        self.workers = workers
+        self.block_bytes = block_bytes
+
+    def block_rows(self, default: int) -> int:
+        return max(int(self.block_bytes // (8 * max(len(self.processed_b), 1))), 1)
+
+    def match(self, queries: Sequence[str]) -> List[RowMatches]:
+        scores = process.cdist(queries, self.processed_b, scorer=self.scorer,
+                               score_cutoff=self.similarity_criterion,
+                               dtype=np.float64, workers=self.workers)
+        result = []
+        for row_scores in scores:
+            match_idx = np.flatnonzero(row_scores >= self.similarity_criterion)
+            match_idx = match_idx[np.argsort(-row_scores[match_idx], kind='stable')][:MATCH_LIMIT]
+            result.append([(float(row_scores[i]), int(i)) for i in match_idx])
+        return result
+
+class LengthBucketEngine(BruteForceEngine):
+    """
+    Сравнение только со строками data2 подходящей длины (см. length_bounds).
+    Строки data2 упорядочиваются по длине один раз, кандидаты для строки
+    data1 - непрерывный отрезок этого порядка. Эффективен при высоком пороге.
+    """
+
+    name = 'length'
+
+    def __init__(self, processed_b: Sequence[str], scorer: Callable, similarity_criterion: float) -> None:
+        super().__init__(processed_b, scorer, similarity_criterion)
+        self.use_token_sort = scorer is fuzz.token_sort_ratio
+        lengths = [self.scored_length(x) for x in processed_b]
+        self.order = sorted(range(len(processed_b)), key=lengths.__getitem__)
+        self.sorted_lengths = [lengths[i] for i in self.order]
+        self.sorted_b = [processed_b[i] for i in self.order]
+
+    def scored_length(self, text: str) -> int:
+        """Длина строки в том виде, в котором ее сравнивает скорер."""
+        # token_sort_ratio сравнивает слова, отсортированные и склеенные через один пробел
+        return len(" ".join(text.split())) if self.use_token_sort else len(text)
+
+    def candidate_range(self, query: str) -> Tuple[int, int]:
+        low, high = length_bounds(self.scored_length(query), self.similarity_criterion)
+        return bisect.bisect_left(self.sorted_lengths, low), bisect.bisect_right(self.sorted_lengths, high)
+
+    def score_positions(self, query: str, positions: Sequence[int]) -> RowMatches:
+        """Оценивает кандидатов по позициям в порядке длин и возвращает лучшие."""
+        matches = process.extract(query, [self.sorted_b[pos] for pos in positions],
+                                  scorer=self.scorer, score_cutoff=self.similarity_criterion,
+                                  limit=None)
+        return _top_matches([(score, self.order[positions[i]]) for _, score, i in matches])
+
+    def match(self, queries: Sequence[str]) -> List[RowMatches]:
+        result = []
+        for query in queries:
+            start, stop = self.candidate_range(query)
+            result.append(self.score_positions(query, range(start, stop)))
+        return result
+
+class NgramIndexEngine(LengthBucketEngine):
+    """
+    Инвертированный индекс n-грамм поверх отбора по длине.
+
+    Лемма о q-граммах: если расстояние Indel равно d, строки имеют не менее
+    max(la, lb) - q + 1 - q * d общих q-грамм. При пороге t расстояние не
+    больше (1 - t) * (la + lb), что дает нижнюю границу числа общих n-грамм
+    для каждого кандидата. Остальные строки data2 не оцениваются.
+    Эффективен на больших справочниках и при умеренном пороге.
+    """
+
+    name = 'ngram'
+
+    def __init__(self, processed_b: Sequence[str], scorer: Callable, similarity_criterion: float) -> None:
+        super().__init__(processed_b, scorer, similarity_criterion)
+        postings: Dict[str, List[int]] = defaultdict(list)
+        for pos, text in enumerate(self.sorted_b):
+            for gram in self.ngrams(text):
+                postings[gram].append(pos)
+        self.postings = {gram: np.array(positions, dtype=np.int64) for gram, positions in postings.items()}
+        self.sorted_lengths_array = np.array(self.sorted_lengths, dtype=np.float64)
+
+    def ngrams(self, text: str) -> List[str]:
+        # n-граммы с повторами: завышенный счет общих n-грамм только ослабляет фильтр
+        if self.use_token_sort:
+            text = " ".join(sorted(text.split()))
+        return [text[i:i + NGRAM_SIZE] for i in range(len(text) - NGRAM_SIZE + 1)]
+
+    def match(self, queries: Sequence[str]) -> List[RowMatches]:
+        t = self.similarity_criterion / 100
+        result = []
+        for query in queries:
+            start, stop = self.candidate_range(query)
+            if start >= stop:
+                result.append([])
+                continue
+
+            hits = [self.postings[gram] for gram in self.ngrams(query) if gram in self.postings]
+            positions = np.concatenate(hits) if hits else np.empty(0, dtype=np.int64)
+            positions = positions[(positions >= start) & (positions < stop)]
+            common = np.bincount(positions - start, minlength=stop - start)
+
+            query_length = self.scored_length(query)
+            lengths = self.sorted_lengths_array[start:stop]
+            required = (np.maximum(query_length, lengths) - NGRAM_SIZE + 1
+                        - NGRAM_SIZE * (1 - t) * (query_length + lengths))
+            candidates = start + np.flatnonzero(common >= np.floor(required - 1e-9))
+            result.append(self.score_positions(query, candidates.tolist()))
+        return result
+
+ENGINES = {engine.name: engine for engine in (BruteForceEngine, CdistEngine, LengthBucketEngine, NgramIndexEngine)}
@@ -0,0 +1,98 @@
+import os
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+from text import NAME_DATA_FILE, NAME_OUTPUT_FILE
+
+# Parquet и Arrow IPC читаются и пишутся через pyarrow
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+# Формат файла по расширению; файлы с незнакомым расширением считаются Excel
+FILE_FORMATS = {
+    '.xlsx': 'xlsx', '.xlsm': 'xlsx', '.xls': 'xlsx',
+    '.csv': 'csv',
+    '.parquet': 'parquet', '.pq': 'parquet',
+    '.arrow': 'arrow', '.feather': 'arrow', '.ipc': 'arrow',
+    '.sqlite': 'sqlite', '.sqlite3': 'sqlite', '.db': 'sqlite',
+}
+
+# Расширение, которое получает файл, если формат задан в конфигурации
+FORMAT_EXTENSIONS = {'xlsx': '.xlsx', 'csv': '.csv', 'parquet': '.parquet', 'arrow': '.arrow',
+                     'sqlite': '.sqlite'}
+
+# Форматы, из которых читаются исходные данные (SQLite - только для результатов)
+INPUT_FORMATS = ('xlsx', 'csv', 'parquet', 'arrow')
+
+WORKING_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "working_files")
+
+def detect_format(file_path: str) -> str:
+    """Формат файла ('xlsx', 'csv', 'parquet', 'arrow', 'sqlite') по расширению."""
+    return FILE_FORMATS.get(os.path.splitext(file_path)[1].lower(), 'xlsx')
+
+def require_pyarrow(file_path: str, action: str) -> None:
+    """ImportError с подсказкой по установке, если pyarrow нет; action - "чтения" или "записи"."""
+    if pyarrow is None:
+        raise ImportError(f"Для {action} {file_path} нужен pyarrow: pip install pyarrow")
+
+@contextmanager
+def replaced_on_success(file_path: str) -> Iterator[str]:
+    """
+    Путь временного файла рядом с file_path. Если блок завершился без
+    исключения, временный файл заменяет file_path, иначе удаляется: при
+    отмене или ошибке посреди записи прежний файл остается целым.
+    """
+    tmp_path = f"{file_path}.{os.getpid()}.tmp"
+    try:
+        yield tmp_path
+        os.replace(tmp_path, file_path)
+    finally:
+        if os.path.isfile(tmp_path):
+            os.remove(tmp_path)
+
+def excel_part_path(file_path: str, part: int) -> str:
+    """
+    Путь к книге-продолжению результатов: первая часть - сам file_path,
+    следующие - имя_2.xlsx, имя_3.xlsx ...
+    """
+    if part == 1:
+        return file_path
+    root, extension = os.path.splitext(file_path)
+    return f"{root}_{part}{extension}"
+
+def resolve_file_path(configured: str, default_name: str, file_format: str = 'auto') -> str:
+    """
+    Путь к файлу данных: заданный в конфигурации (относительный путь
+    считается от working_files) или working_files/default_name.
+
+    Если file_format задан явно ('csv', 'parquet' ...), а расширение файла
+    ему не соответствует, расширение заменяется: формат из конфигурации
+    важнее имени файла. При 'auto' формат определяется по расширению.
+    """
+    file_path = os.path.join(WORKING_DIR, configured or default_name)
+    if file_format != 'auto':
+        if file_format not in FORMAT_EXTENSIONS:
+            raise ValueError(f"Неизвестный формат файла: {file_format}")
+        if detect_format(file_path) != file_format:
+            file_path = os.path.splitext(file_path)[0] + FORMAT_EXTENSIONS[file_format]
+    return file_path
+
+def data_file_path(config: Dict[str, Any]) -> str:
+    """Путь к исходным данным по input_options конфигурации."""
+    options = config.get("input_options", {})
+    return resolve_file_path(options.get("data_file", ""), NAME_DATA_FILE, options.get("format", "auto"))
+
+def reference_file_path(config: Dict[str, Any]) -> Optional[str]:
+    """
+    Путь к отдельному файлу со справочником data2 (input_options.reference_file)
+    или None, если data2 берется из файла исходных данных.
+    """
+    configured = config.get("input_options", {}).get("reference_file", "")
+    return os.path.join(WORKING_DIR, configured) if configured else None
+
+def output_file_path(config: Dict[str, Any]) -> str:
+    """Путь к файлу результатов по output_options конфигурации."""
+    options = config.get("output_options", {})
+    return resolve_file_path(options.get("output_file", ""), NAME_OUTPUT_FILE, options.get("format", "auto"))
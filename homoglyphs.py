@@ -0,0 +1,25 @@
+from typing import Dict
+
+# Латинские и греческие буквы, неотличимые на вид от кириллических, в нижнем
+# регистре (текст к этому моменту уже переведен в нижний регистр, поэтому
+# сюда входят и строчные пары заглавных двойников: B/В -> b/в, H/Н -> h/н ...).
+# Буква ё заменяется на е: в названиях ее пишут через раз
+_HOMOGLYPHS = {
+    'a': 'а', 'b': 'в', 'c': 'с', 'e': 'е', 'h': 'н', 'k': 'к', 'm': 'м',
+    'o': 'о', 'p': 'р', 't': 'т', 'x': 'х', 'y': 'у',
+    'α': 'а', 'ε': 'е', 'κ': 'к', 'ο': 'о', 'ρ': 'р', 'τ': 'т', 'υ': 'у', 'χ': 'х',
+    'ё': 'е',
+}
+
+# Транслитерация кириллицы латиницей (как в загранпаспортах, без диакритики)
+_TRANSLITERATION = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'e', 'ж': 'zh',
+    'з': 'z', 'и': 'i', 'й': 'i', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o',
+    'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'у': 'u', 'ф': 'f', 'х': 'kh', 'ц': 'ts',
+    'ч': 'ch', 'ш': 'sh', 'щ': 'shch', 'ъ': 'ie', 'ы': 'y', 'ь': '', 'э': 'e',
+    'ю': 'iu', 'я': 'ia',
+}
+
+# Таблицы для str.translate: замена выполняется одним проходом на C
+HOMOGLYPH_TABLE: Dict[int, str] = str.maketrans(_HOMOGLYPHS)
+TRANSLITERATION_TABLE: Dict[int, str] = str.maketrans(_TRANSLITERATION)
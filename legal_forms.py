@@ -0,0 +1,137 @@
+from collections import deque
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+# Совпадение в строке: (начало, конец, индекс формы в LegalFormMatcher.forms)
+FormMatch = Tuple[int, int, int]
+
+# Найденные в строке формы (в написании LegalFormMatcher.forms) в порядке появления
+LegalForms = Tuple[str, ...]
+
+class CleanedName(NamedTuple):
+    """Очищенное название и ОПФ, найденные в исходном тексте."""
+    cleaned: str
+    legal_forms: LegalForms = ()
+
+def is_word_char(char: str) -> bool:
+    # То же, что \w в модуле re для строк
+    return char.isalnum() or char == '_'
+
+class LegalFormMatcher:
+    """
+    Поиск организационно-правовых форм (ООО, ИП, Ltd, S.A. ...) автоматом
+    Ахо-Корасик: строка просматривается один раз независимо от числа форм.
+
+    Формы сравниваются без учета регистра и как отдельные слова: если форма
+    начинается (заканчивается) буквой или цифрой, перед ней (после нее) не
+    должно быть буквы или цифры, как у \\b в регулярном выражении. Из
+    пересекающихся совпадений выбирается самое левое, а из них - самое длинное.
+    """
+
+    def __init__(self, forms: Iterable[str], translation: Optional[Dict[int, str]] = None) -> None:
+        # Повторы (в том числе отличающиеся только регистром) отбрасываются,
+        # в результатах форма выдается в написании первого вхождения.
+        # translation - таблица str.translate, которой нормализуется текст
+        # (см. homoglyphs.py): формы приводятся к тому же виду
+        unique: Dict[str, str] = {}
+        for form in forms:
+            form = form.strip()
+            pattern = form.lower().translate(translation) if translation else form.lower()
+            if pattern and pattern not in unique:
+                unique[pattern] = form
+        self.forms: List[str] = list(unique.values())
+        self._patterns: List[str] = list(unique)
+        self._bounded_left = [is_word_char(pattern[0]) for pattern in self._patterns]
+        self._bounded_right = [is_word_char(pattern[-1]) for pattern in self._patterns]
+        self._build()
+
+    @property
+    def patterns(self) -> List[str]:
+        """Формы в том виде, в котором они ищутся в тексте (нижний регистр, после translation)."""
+        return list(self._patterns)
+
+    def _build(self) -> None:
+        goto: List[Dict[str, int]] = [{}]
+        output: List[List[int]] = [[]]
+        for idx, pattern in enumerate(self._patterns):
+            node = 0
+            for char in pattern:
+                child = goto[node].get(char)
+                if child is None:
+                    child = len(goto)
+                    goto[node][char] = child
+                    goto.append({})
+                    output.append([])
+                node = child
+            output[node].append(idx)
+
+        # Ссылки неудач строятся обходом в ширину: у узла глубины d ссылка
+        # ведет на узел меньшей глубины, который к этому моменту уже обработан.
+        # Заодно переходы по ссылкам неудач сворачиваются в полную таблицу
+        # переходов (ДКА), чтобы при поиске на каждый символ был один dict.get;
+        # символы, которых нет ни в одной форме, ведут в корень
+        fail = [0] * len(goto)
+        delta: List[Dict[str, int]] = [dict(goto[0])] + [{} for _ in goto[1:]]
+        queue = deque(goto[0].values())
+        while queue:
+            node = queue.popleft()
+            delta[node] = {**delta[fail[node]], **goto[node]}
+            for char, child in goto[node].items():
+                queue.append(child)
+                fail[child] = delta[fail[node]].get(char, 0)
+                output[child] = output[child] + output[fail[child]]
+
+        self._delta = delta
+        self._output = output
+
+    def find(self, text: str) -> List[FormMatch]:
+        """Непересекающиеся совпадения форм в text (text должен быть в нижнем регистре)."""
+        delta, output = self._delta, self._output
+        patterns = self._patterns
+        candidates: List[FormMatch] = []
+        node = 0
+        for pos, char in enumerate(text):
+            node = delta[node].get(char, 0)
+            if not output[node]:
+                continue
+            for idx in output[node]:
+                end = pos + 1
+                start = end - len(patterns[idx])
+                if self._bounded_left[idx] and start > 0 and is_word_char(text[start - 1]):
+                    continue
+                if self._bounded_right[idx] and end < len(text) and is_word_char(text[end]):
+                    continue
+                candidates.append((start, end, idx))
+
+        if len(candidates) < 2:
+            return candidates
+        candidates.sort(key=lambda match: (match[0], -match[1]))
+        matches: List[FormMatch] = []
+        last_end = 0
+        for match in candidates:
+            if match[0] >= last_end:
+                matches.append(match)
+                last_end = match[1]
+        return matches
+
+    def split(self, text: str) -> Tuple[str, LegalForms]:
+        """
+        Возвращает текст в нижнем регистре без форм (каждая заменена пробелом,
+        как при удалении регулярным выражением) и найденные формы в порядке
+        появления, чтобы их можно было сравнивать отдельно от названия
+        (см. comparison_options.match_legal_forms).
+        """
+        text = text.lower()
+        matches = self.find(text)
+        if not matches:
+            return text, ()
+        pieces = []
+        last_end = 0
+        for start, end, _ in matches:
+            pieces.append(text[last_end:start])
+            last_end = end
+        pieces.append(text[last_end:])
+        return ' '.join(pieces), tuple(self.forms[idx] for _, _, idx in matches)
+
+    def strip(self, text: str) -> str:
+        """Текст в нижнем регистре без организационно-правовых форм."""
+        return self.split(text)[0]
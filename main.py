@@ -1,8 +1,9 @@
 import os
+import multiprocessing
 import pandas as pd
 from textual import work
 from textual.app import App, ComposeResult
-from textual.widgets import Button, Header, Footer, Markdown, MaskedInput, Static, LoadingIndicator, Switch
+from textual.widgets import Button, Header, Footer, Markdown, MaskedInput, Static, ProgressBar, Select, Switch
 from textual.containers import Horizontal, Container
 from textual.screen import ModalScreen
 from textual.binding import Binding
@@ -11,42 +12,12 @@ from textual.reactive import reactive
 
 # Assuming these modules are available and contain the necessary constants/functions
 # In a real-world scenario, I would also refactor these modules.
-from text import TEXT_BRIEF_INTRODUCTION, TEXT_HELP, EXAMPLE, NAME_DATA_FILE, correct_columns, NAME_OUTPUT_FILE
-from comparison import create_file_matches
-from custom_errors import Sheet_too_large_Error
-from utils import update_config, read_config, DEFAULT_CONFIG
-
-# --- Utility Functions ---
-
-def check_sheet_exists(file_path: str, sheet_name: str = 'Sheet1') -> bool:
-    """
-    Checks if a specific sheet exists in an Excel file without reading the whole file.
-    
-    Args:
-        file_path: Path to the Excel file.
-        sheet_name: Name of the sheet to check.
-        
-    Returns:
-        True if the sheet exists, False otherwise.
-    """
-    try:
-        # Use read_excel with sheet_name=None to get a dictionary of all sheets
-        # and check if the target sheet is in the keys. This is generally faster
-        # than trying to read the sheet and catching an exception.
-        excel_file = pd.ExcelFile(file_path)
-        return sheet_name in excel_file.sheet_names
-    except ValueError as e:
-        # Catch pandas ValueError if the file is not a valid Excel file
-        # or if there's a more general read error.
-        if "Worksheet" in str(e) and "not found" in str(e):
-            return False
-        # Re-raise other ValueErrors
-        raise
-    except FileNotFoundError:
-        return False
-    except Exception:
-        # Catch other potential errors during file reading (e.g., corrupted file)
-        return False
+from text import TEXT_BRIEF_INTRODUCTION, TEXT_HELP, EXAMPLE, NAME_DATA_FILE, NAME_OUTPUT_FILE, STAGE_LABELS
+from comparison import create_file_matches, CancellationToken, ProgressInfo
+from custom_errors import Sheet_too_large_Error, Comparison_cancelled_Error, Input_data_Error
+from formats import data_file_path
+from readers import read_input_data
+from utils import update_config, read_config, load_config, DEFAULT_CONFIG, NORMALIZERS, WordNormalizer, get_normalizer
 
 # --- Modal Screens ---
 
@@ -64,10 +35,10 @@ class SettingsScreen(ModalScreen):
         
         # 2. Извлекаем значения и преобразуем их в булевы для Switch
         # Логика инверсии:
-        # - use_stemming_or_lemmatization: 1 (вкл) -> True (Switch вкл)
         # - remove_*: 1 (удалить) -> False (Switch выкл, т.е. "не учитывать")
+        # Способ нормализации учитывает и use_stemming_or_lemmatization (0 -> без нормализации)
         
-        lemming_value = bool(cleaning_options.get("use_stemming_or_lemmatization", 1))
+        normalizer_value = get_normalizer({"cleaning_options": cleaning_options}).name
         digits_value = not bool(cleaning_options.get("remove_digits", 0))
         forms_value = not bool(cleaning_options.get("remove_legal_forms", 1))
         sort_value = not bool(cleaning_options.get("sort_words", 1))
@@ -75,7 +46,9 @@ class SettingsScreen(ModalScreen):
         yield Container(
             Horizontal(
                 Static("Нормализация слов:", classes="statics-settings-modal"),
-                Switch(value=lemming_value, id='switch-lemming', classes="switchs-settings-modal"),
+                Select([(normalizer.title, name) for name, normalizer in NORMALIZERS.items()],
+                       value=normalizer_value, allow_blank=False,
+                       id='select-normalizer', classes="selects-settings-modal"),
                 classes="horizontals-settings-modal",
                 id='horizontal-lemming-settings-modal'
                 ),
@@ -104,7 +77,8 @@ class SettingsScreen(ModalScreen):
         )
     
     def on_mount(self) -> None:
-        self.query_one('#horizontal-lemming-settings-modal').tooltip = 'Приведение слов исходного текста к словарной форме'
+        self.query_one('#horizontal-lemming-settings-modal').tooltip = ('Приведение слов исходного текста к общей форме: '
+                                                                      'лемматизация точнее, стемминг быстрее')
         self.query_one('#horizontal-sort-settings-modal').tooltip = 'Важна ли последовательность слов в исходном тексте'
         self.query_one('#horizontal-digits-settings-modal').tooltip = 'Учитывать числовые значения в исходном тексте'
         self.query_one('#horizontal-forms-settings-modal').tooltip = 'различать ООО/ЗАО/ИП и т.д.'
@@ -113,9 +87,9 @@ class SettingsScreen(ModalScreen):
         """Обрабатывает нажатие кнопки "Сохранить"."""
         if event.button.id == "button-settings-modal":
             
-            # Собираем значения из виджетов Switch
-            # True (Switch вкл) -> 1 (в config), False (Switch выкл) -> 0 (в config)
-            lemming_val = int(self.query_one('#switch-lemming', Switch).value)
+            # Способ нормализации: "без нормализации" -> use_stemming_or_lemmatization = 0
+            normalizer_val = self.query_one('#select-normalizer', Select).value
+            lemming_val = int(normalizer_val != WordNormalizer.name)
             
             # Инверсия: True (учитывать/Switch вкл) -> 0 (не удалять/в config), 
             # False (не учитывать/Switch выкл) -> 1 (удалить/в config)
@@ -126,6 +100,7 @@ class SettingsScreen(ModalScreen):
             updates = {
                 "cleaning_options": {
                     "use_stemming_or_lemmatization": lemming_val,
+                    "normalizer": normalizer_val,
                     "remove_digits": remove_digits_val,
                     "remove_legal_forms": remove_forms_val,
                     "sort_words": sort_words_val,
@@ -239,6 +214,10 @@ class FuzzyMatchToolApp(App[str]):
         width: 100%;
         height: 1;
     }
+    #label_progress_bar {
+        width: auto;
+        padding: 0 1;
+    }
 
     #buttons {
         align: center middle;
@@ -288,7 +267,7 @@ class FuzzyMatchToolApp(App[str]):
             align: center middle;
         }
             #container-settings-modal {
-               width: 55; 
+               width: 70; 
                height: 20;
                border: solid $accent;
                background: $surface;
@@ -303,6 +282,12 @@ class FuzzyMatchToolApp(App[str]):
                content-align: right middle;
                width: 20%;
            }
+           .selects-settings-modal {
+               width: 50%;
+           }
+           #horizontal-lemming-settings-modal .statics-settings-modal {
+               width: 50%;
+           }
            #horizontals-button-settings-modal{
                align: center bottom;
                }
@@ -316,7 +301,9 @@ class FuzzyMatchToolApp(App[str]):
     BINDINGS = [
         Binding(key="f1", action="push_screen('help')", description="Помощь", key_display="F1"),
         Binding(key="f2", action="open_dir", description="Открыть папку с файлами", key_display="F2"),
-        Binding(key="f3", action="push_screen('settings')", description="Настройки", key_display="F3")
+        Binding(key="f3", action="push_screen('settings')", description="Настройки", key_display="F3"),
+        Binding(key="f4", action="cancel_comparison", description="Отменить сравнение", key_display="F4"),
+        Binding(key="f5", action="resume_comparison", description="Продолжить сравнение", key_display="F5")
     ]
     # Инициализация reactive-переменной из конфига
     config = read_config()
@@ -334,11 +321,14 @@ class FuzzyMatchToolApp(App[str]):
             Button("🔧 Установить уровень схожести", id="set_similarity_level", variant="primary"),
             Button("🔍 Найти схожие значения", id="find_similar_values", variant="primary"),
             id="buttons")
-        yield Horizontal(LoadingIndicator(), id='horizontal_progress_bar')
+        yield Horizontal(ProgressBar(id='progress_bar'),
+                         Static('', id='label_progress_bar'),
+                         id='horizontal_progress_bar')
         yield Footer(show_command_palette = False)
 
     def on_mount(self) -> None:
-        self.query_one(LoadingIndicator).visible = False
+        self.cancel_token = None
+        self.query_one('#horizontal_progress_bar').visible = False
         # Регистрация экранов
         self.install_screen(HelpScreen(), name="help")
         self.install_screen(SettingsScreen(), name="settings")
@@ -384,9 +374,40 @@ class FuzzyMatchToolApp(App[str]):
             else:
                 self.notify("Не удалось открыть папку автоматически. Рабочая папка: working_files", severity='warning')
 
+    def action_cancel_comparison(self) -> None:
+        """Действие при нажатии F4 - запрашивает остановку текущего сравнения."""
+        if self.cancel_token is not None and not self.cancel_token.cancelled:
+            self.cancel_token.cancel()
+            self.notify('Останавливаем сравнение...', title="Информация", severity='information', timeout=2)
+
+    def action_resume_comparison(self) -> None:
+        """Действие при нажатии F5 - обрабатывает строки, не успевшие в прошлый запуск."""
+        if self.cancel_token is None:
+            self.start_comparison_process(resume=True)
+
+    def update_progress(self, info: ProgressInfo) -> None:
+        """Отображает этап, число обработанных строк и скорость сравнения."""
+        progress_bar = self.query_one('#progress_bar', ProgressBar)
+        label = self.query_one('#label_progress_bar', Static)
+        stage = STAGE_LABELS.get(info.stage, info.stage)
+        if info.stage == 'matching' and info.rows_total:
+            progress_bar.update(total=info.rows_total, progress=info.rows_done)
+            label.update(f"{stage}: {info.rows_done}/{info.rows_total} строк, "
+                         f"{info.pairs_per_sec:,.0f} пар/сек".replace(',', ' '))
+        else:
+            progress_bar.update(total=None)
+            label.update(stage)
+
+    def report_progress(self, info: ProgressInfo) -> None:
+        """Callback прогресса для ядра сравнения, вызывается из потока worker."""
+        self.call_from_thread(self.update_progress, info)
+
     def finish_processing(self):
         """Сбрасывает состояние интерфейса после завершения обработки."""
-        self.query_one(LoadingIndicator).visible = False
+        self.cancel_token = None
+        self.query_one('#horizontal_progress_bar').visible = False
+        self.query_one('#progress_bar', ProgressBar).update(total=None, progress=0)
+        self.query_one('#label_progress_bar', Static).update('')
         # Используем query_many для повышения производительности
         for button in self.query("Button"):
             button.disabled = False
@@ -413,23 +434,24 @@ class FuzzyMatchToolApp(App[str]):
                             severity='error',
                             timeout=5)
             
-    def start_comparison_process(self):
+    def start_comparison_process(self, resume: bool = False):
         """Инициализирует процесс сравнения, блокирует UI и запускает worker."""
-        self.query_one(LoadingIndicator).visible = True
+        self.cancel_token = CancellationToken()
+        self.query_one('#horizontal_progress_bar').visible = True
         for button in self.query("Button"):
             button.disabled = True
         
         # Запускаем worker
-        self.create_and_open_excel_comparison()
+        self.create_and_open_excel_comparison(resume)
 
     @work(thread=True)
-    def create_and_open_excel_comparison(self):
+    def create_and_open_excel_comparison(self, resume: bool = False):
         """
         Worker-метод: выполняет сравнение данных и открывает файл с результатами.
         """
         
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        file_path = os.path.join(script_dir, "working_files", NAME_DATA_FILE)
+        # Путь и формат исходных данных задаются в input_options конфигурации
+        file_path = data_file_path(load_config())
 
         if not os.path.isfile(file_path):
             self.notify(f'Отсутствует {NAME_DATA_FILE}. Нажмите 📋 Открыть исходные данные, чтобы сформировать и заполнить файл',
@@ -439,74 +461,17 @@ class FuzzyMatchToolApp(App[str]):
             self.call_later(self.finish_processing)
             return
             
-        if not check_sheet_exists(file_path):
-            self.notify(f'В {NAME_DATA_FILE} отсутствует лист Sheet1.',
-                            title="Ошибка",
-                            severity='error',
-                            timeout=5)
-            self.call_later(self.finish_processing)
-            return
-            
-        try:
-            # Чтение данных
-            df = pd.read_excel(io=file_path, sheet_name='Sheet1')
-        except Exception as e:
-            self.notify(f"Ошибка чтения файла: {e}", title="Ошибка", severity='error', timeout=10)
-            self.call_later(self.finish_processing)
-            return
+        # В потоковом режиме data1 читается блоками при сравнении, а не целиком здесь
+        df = None
+        if not int(load_config().get("comparison_options", {}).get("stream_chunk_rows", 0)):
+            try:
+                # Книга читается один раз: проверка листа, чтение и валидация данных
+                df = read_input_data(file_path)
+            except Input_data_Error as e:
+                self.notify(str(e), title="Ошибка", severity='error', timeout=10)
+                self.call_later(self.finish_processing)
+                return
 
-        # --- Валидация данных ---
-        
-        # 1. Проверка количества столбцов
-        if len(df.columns) != 2:
-            self.notify(f"""\
-В {NAME_DATA_FILE} должно быть только два столбца.
-Нажмите 📋 Открыть исходные данные, чтобы открыть для редактирования {NAME_DATA_FILE}""",
-                            title="Ошибка",
-                            severity='error',
-                            timeout=10)
-            self.call_later(self.finish_processing)
-            return
-            
-        # 2. Проверка наличия необходимых столбцов
-        if not set(correct_columns).issubset(set(df.columns)):
-            missing_columns = set(correct_columns) - set(df.columns)
-            missing_columns_str = ', '.join(missing_columns)
-            error_message = f"""\
-В {NAME_DATA_FILE} ошибки в именах столбцов: {missing_columns_str}.
-Нажмите 📋 Открыть исходные данные, чтобы открыть для редактирования {NAME_DATA_FILE}"""
-            self.notify(error_message,
-                            title="Ошибка",
-                            severity='error',
-                            timeout=10)
-            self.call_later(self.finish_processing)
-            return
-        # 3. Проверка заполненности первой строки (проверка на пустой файл)
-        if df.empty or df.iloc[0].isnull().all():
-            self.notify(f"Файл {NAME_DATA_FILE} возможно пуст или не содержит данных. Проверьте, заполнена ли первая строка таблицы.",
-                            title="Ошибка",
-                            severity='error',
-                            timeout=10)
-            self.call_later(self.finish_processing)
-            return
-        
-        # 4. Проверка на пустые значения в первой строке (как в оригинале)
-        if df.iloc[0].isnull().any():
-            null_columns = df.iloc[0].isnull()
-            missing_columns = null_columns[null_columns].index.tolist()
-            missing_columns_str = ', '.join(missing_columns)
-            error_message = f"""\
-В {NAME_DATA_FILE} не заполнена первая строка таблицы в следующих столбцах: {missing_columns_str}.
-Нажмите 📋 Открыть исходные данные, чтобы открыть для редактирования {NAME_DATA_FILE}"""
-            self.notify(error_message,
-                            title="Ошибка",
-                            severity='error',
-                            timeout=10)
-            self.call_later(self.finish_processing)
-            return
-        
-        
-        
         # --- Обработка данных ---
         
         self.notify('Начинаем обработку данных.',
@@ -515,9 +480,32 @@ class FuzzyMatchToolApp(App[str]):
                         timeout=2)
         try:
             # Используем int(self.similarity_score) для получения актуального значения
-            create_file_matches(int(self.similarity_score))
+            summary = create_file_matches(int(self.similarity_score),
+                                          progress_callback=self.report_progress,
+                                          cancel_token=self.cancel_token,
+                                          resume=resume,
+                                          data=df)
             
-            output_file_path = os.path.join(script_dir, "working_files", NAME_OUTPUT_FILE)
+            self.notify(summary.as_text(),
+                            title="Итоги сравнения",
+                            severity='information',
+                            timeout=10)
+            
+            if summary.memory_ceiling_exceeded:
+                self.notify(f"Сравнение не уложилось в потолок памяти {summary.max_memory_mb:.0f} МБ. "
+                            f"Увеличьте max_memory_mb в config.json.",
+                                title="Информация",
+                                severity='warning',
+                                timeout=10)
+            
+            if summary.unprocessed_rows:
+                self.notify(f"Время на сравнение истекло, не обработано строк: {summary.unprocessed_rows}. "
+                            f"Нажмите F5, чтобы продолжить сравнение.",
+                                title="Информация",
+                                severity='warning',
+                                timeout=10)
+            
+            output_file_path = summary.output_file
             
             if os.path.isfile(output_file_path):
                 self.notify('Открываем файл с результатами сравнения.',
@@ -542,8 +530,14 @@ class FuzzyMatchToolApp(App[str]):
                                 severity='error',
                                 timeout=5)
         
+        except Comparison_cancelled_Error:
+            self.notify("Сравнение отменено.",
+                            title="Информация",
+                            severity='information',
+                            timeout=5)
         except Sheet_too_large_Error:
-            self.notify("Найденных совпадений больше строк в excel.",
+            self.notify("Найденных совпадений больше строк в excel. Чтобы записать их на несколько листов "
+                        "или в несколько файлов, задайте excel_overflow: sheets или files в config.json.",
                             title="Ошибка",
                             severity='error',
                             timeout=5)
@@ -562,6 +556,8 @@ class FuzzyMatchToolApp(App[str]):
 
 
 if __name__ == "__main__":
+    # Нужно для пула процессов очистки в собранном exe (spawn на Windows)
+    multiprocessing.freeze_support()
     # Убеждаемся, что app создается только один раз
     app = FuzzyMatchToolApp()
     app.run()
@@ -0,0 +1,215 @@
+import os
+import pickle
+import sys
+import tempfile
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from writers import MatchBatch
+
+# Оценка размера одной пары (data1, data2, score) в памяти, байт
+PAIR_SIZE_BYTES = 300
+
+# Количество файлов-разделов при сбросе пар на диск
+SPILL_PARTITIONS = 64
+
+# Нижняя граница бюджета памяти. Если потолок уже достигнут, пакеты пар и
+# блоки cdist не сжимаются до одной строки (это замедляет работу в разы),
+# а превышение потолка отмечается в итогах запуска
+MIN_BUDGET_BYTES = 8 * 2**20
+
+# Оценка памяти одной строки data1 в блоке чтения (значение, очищенная строка,
+# слова, буферы pyarrow), байт, и границы размера такого блока
+STREAM_ROW_BYTES = 2048
+MIN_STREAM_CHUNK_ROWS = 1000
+MAX_STREAM_CHUNK_ROWS = 100_000
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+try:
+    import resource
+except ImportError:
+    # На Windows модуля resource нет
+    resource = None
+
+if sys.platform == 'win32':
+    import ctypes
+    from ctypes import wintypes
+
+    class _ProcessMemoryCounters(ctypes.Structure):
+        """PROCESS_MEMORY_COUNTERS из psapi.h."""
+        _fields_ = [('cb', wintypes.DWORD),
+                    ('PageFaultCount', wintypes.DWORD),
+                    ('PeakWorkingSetSize', ctypes.c_size_t),
+                    ('WorkingSetSize', ctypes.c_size_t),
+                    ('QuotaPeakPagedPoolUsage', ctypes.c_size_t),
+                    ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                    ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t),
+                    ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                    ('PagefileUsage', ctypes.c_size_t),
+                    ('PeakPagefileUsage', ctypes.c_size_t)]
+
+def _windows_memory_counters() -> Optional["_ProcessMemoryCounters"]:
+    # Рабочий набор процесса через GetProcessMemoryInfo - без psutil,
+    # которого нет в собранном приложении
+    if sys.platform != 'win32':
+        return None
+    try:
+        get_current_process = ctypes.windll.kernel32.GetCurrentProcess
+        get_current_process.restype = wintypes.HANDLE
+        get_memory_info = ctypes.windll.psapi.GetProcessMemoryInfo
+        get_memory_info.argtypes = [wintypes.HANDLE, ctypes.POINTER(_ProcessMemoryCounters), wintypes.DWORD]
+        get_memory_info.restype = wintypes.BOOL
+        counters = _ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        if not get_memory_info(get_current_process(), ctypes.byref(counters), counters.cb):
+            return None
+        return counters
+    except (OSError, AttributeError):
+        return None
+
+def current_rss_mb() -> Optional[float]:
+    """Текущий объем резидентной памяти процесса в МБ (None, если узнать нельзя)."""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss / 2**20
+    counters = _windows_memory_counters()
+    if counters is not None:
+        return counters.WorkingSetSize / 2**20
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def peak_rss_mb() -> Optional[float]:
+    """Пиковый объем резидентной памяти процесса в МБ (None, если узнать нельзя)."""
+    # Linux: VmHWM относится к текущему образу процесса. ru_maxrss переживает
+    # exec и у процесса, запущенного через multiprocessing (spawn), включает
+    # память родителя на момент fork
+    try:
+        with open('/proc/self/status') as file:
+            for line in file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 2**10
+    except (OSError, ValueError, IndexError):
+        pass
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux возвращает килобайты, macOS - байты
+        return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+    if psutil is not None:
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', info.rss) / 2**20
+    counters = _windows_memory_counters()
+    if counters is not None:
+        return counters.PeakWorkingSetSize / 2**20
+    return None
+
+def available_budget_bytes(max_memory_mb: float) -> int:
+    """
+    Сколько байт еще можно занять, не выходя за max_memory_mb:
+    потолок за вычетом уже занятой процессом памяти, но не меньше MIN_BUDGET_BYTES.
+    """
+    used_mb = current_rss_mb() or 0
+    return max(int((max_memory_mb - used_mb) * 2**20), MIN_BUDGET_BYTES)
+
+def budget_chunk_rows(max_memory_mb: float) -> int:
+    """
+    Сколько строк data1 читать за раз в режиме ограничения памяти: блок
+    занимает не больше восьмой части свободного бюджета.
+    """
+    rows = available_budget_bytes(max_memory_mb) // 8 // STREAM_ROW_BYTES
+    return int(min(max(rows, MIN_STREAM_CHUNK_ROWS), MAX_STREAM_CHUNK_ROWS))
+
+class SpillDeduplicator:
+    """
+    Удаление дубликатов пар с ограниченной памятью.
+
+    Пары раскладываются по SPILL_PARTITIONS файлам на диске по хэшу data1,
+    после чего каждый раздел дедуплицируется отдельно. Раздел, не
+    помещающийся в бюджет, рекурсивно делится с новой солью хэша.
+    Порядок пар на выходе не совпадает с порядком поступления, но все пары
+    одного data1 выдаются подряд (это нужно раскладке результатов 'wide').
+    """
+
+    def __init__(self, max_memory_mb: float, batch_size: int, spill_dir: Optional[str] = None) -> None:
+        self.max_memory_mb = max_memory_mb
+        self.batch_size = batch_size
+        self.spill_dir = spill_dir
+
+    @property
+    def budget_bytes(self) -> int:
+        # Бюджет пересчитывается при каждом обращении: занятая память меняется по ходу работы
+        return max(available_budget_bytes(self.max_memory_mb), PAIR_SIZE_BYTES * self.batch_size)
+
+    def dedupe(self, batches: Iterable[MatchBatch]) -> Iterator[MatchBatch]:
+        with tempfile.TemporaryDirectory(prefix='spill_', dir=self.spill_dir) as tmp_dir:
+            paths = self._partition(batches, tmp_dir, salt=0)
+            yield from self._dedupe_partitions(paths, tmp_dir, salt=0)
+
+    def _partition(self, batches: Iterable[MatchBatch], tmp_dir: str, salt: int) -> List[str]:
+        paths = [os.path.join(tmp_dir, f'part_{salt}_{i}.pkl') for i in range(SPILL_PARTITIONS)]
+        files = [open(path, 'wb') for path in paths]
+        buffers: Dict[int, MatchBatch] = {}
+        buffered = 0
+        flush_pairs = None
+        try:
+            for batch in batches:
+                if flush_pairs is None:
+                    # Буфер сбрасывается на диск, когда занимает четверть бюджета;
+                    # бюджет считается после первого пакета, когда данные уже загружены
+                    flush_pairs = max(self.budget_bytes // (4 * PAIR_SIZE_BYTES), 1)
+                for pair in batch:
+                    part = hash((salt, pair[0])) % SPILL_PARTITIONS
+                    buffers.setdefault(part, []).append(pair)
+                buffered += len(batch)
+                if buffered >= flush_pairs:
+                    self._flush(buffers, files)
+                    buffered = 0
+            self._flush(buffers, files)
+        finally:
+            for file in files:
+                file.close()
+        return paths
+
+    @staticmethod
+    def _flush(buffers: Dict[int, MatchBatch], files: List) -> None:
+        for part, pairs in buffers.items():
+            pickle.dump(pairs, files[part], protocol=pickle.HIGHEST_PROTOCOL)
+        buffers.clear()
+
+    @staticmethod
+    def _read(path: str) -> Iterator[MatchBatch]:
+        with open(path, 'rb') as file:
+            while True:
+                try:
+                    yield pickle.load(file)
+                except EOFError:
+                    return
+
+    def _dedupe_partitions(self, paths: List[str], tmp_dir: str, salt: int) -> Iterator[MatchBatch]:
+        for path in paths:
+            # Размер на диске примерно в 3 раза меньше размера объектов в памяти
+            if os.path.getsize(path) * 3 > self.budget_bytes // 2 and salt < 8:
+                sub_paths = self._partition(self._read(path), tmp_dir, salt + 1)
+                os.remove(path)
+                yield from self._dedupe_partitions(sub_paths, tmp_dir, salt + 1)
+                continue
+
+            # data1 -> {data2: пара}: повторы отбрасываются, пары группируются по data1
+            groups: Dict[str, Dict[str, Tuple]] = {}
+            for pairs in self._read(path):
+                for pair in pairs:
+                    groups.setdefault(pair[0], {}).setdefault(pair[1], pair)
+            batch: MatchBatch = []
+            for group in groups.values():
+                batch.extend(group.values())
+                if len(batch) >= self.batch_size:
+                    yield batch
+                    batch = []
+            del groups
+            if batch:
+                yield batch
+            os.remove(path)
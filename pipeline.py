@@ -0,0 +1,109 @@
+import queue
+import threading
+import time
+from typing import Callable, Iterable, Iterator, Optional
+
+from writers import MatchBatch, WrittenResults
+
+# Сколько пакетов совпадений может ждать записи; когда очередь полна,
+# сравнение приостанавливается (обратное давление), и память не растет
+WRITER_QUEUE_BATCHES = 8
+
+# Как часто сравнение, ожидающее места в очереди, проверяет, жива ли запись, сек
+_PUT_TIMEOUT_SEC = 0.5
+
+# Конец потока пакетов
+_END = object()
+
+class _Failure:
+    """Исключение в генераторе пакетов, передаваемое потоку записи."""
+
+    def __init__(self, error: BaseException) -> None:
+        self.error = error
+
+class BackgroundWriter:
+    """
+    Конвейер "сравнение -> запись": функция записи работает в отдельном
+    потоке и забирает пакеты из ограниченной очереди, а сравнение в
+    вызывающем потоке кладет их туда. Пока файл пишется, следующий блок
+    строк уже сравнивается.
+
+    Считается, сколько каждая сторона простаивала: сравнение - в ожидании
+    места в полной очереди (запись не успевает), запись - в ожидании пакетов
+    из пустой очереди (не успевает сравнение).
+
+    Ошибка записи (нет доступа к файлу, переполнение листа) останавливает
+    сравнение и поднимается в вызывающем потоке; ошибка или отмена в
+    сравнении передается функции записи тем же исключением, как при записи
+    без отдельного потока. Функции writers пишут во временный файл и при
+    исключении удаляют его, поэтому прежний файл результатов не меняется.
+    """
+
+    def __init__(self, write: Callable[[Iterable[MatchBatch]], WrittenResults],
+                 max_batches: int = WRITER_QUEUE_BATCHES) -> None:
+        self.write = write
+        self.queue: "queue.Queue[object]" = queue.Queue(maxsize=max(max_batches, 1))
+        self.producer_blocked_sec = 0.0
+        self.consumer_blocked_sec = 0.0
+        self.result: Optional[WrittenResults] = None
+        self.error: Optional[BaseException] = None
+        self._thread = threading.Thread(target=self._consume, name='results-writer', daemon=True)
+
+    def run(self, batches: Iterable[MatchBatch]) -> WrittenResults:
+        """Пропускает пакеты через поток записи; возвращает результат функции записи."""
+        self._thread.start()
+        try:
+            for batch in batches:
+                self._put(batch)
+        except BaseException as e:
+            if self.error is None:
+                # Запись прерывается тем же исключением; прежний файл результатов остается
+                try:
+                    self._put(_Failure(e))
+                except BaseException:
+                    pass
+                self._thread.join()
+            raise
+        self._put(_END)
+        self._thread.join()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    def _put(self, item: object) -> None:
+        started = time.perf_counter()
+        try:
+            while True:
+                if self.error is not None:
+                    # Запись остановилась с ошибкой: сравнивать дальше незачем
+                    raise self.error
+                try:
+                    self.queue.put(item, timeout=_PUT_TIMEOUT_SEC)
+                    return
+                except queue.Full:
+                    continue
+        finally:
+            self.producer_blocked_sec += time.perf_counter() - started
+
+    def _batches(self) -> Iterator[MatchBatch]:
+        while True:
+            started = time.perf_counter()
+            item = self.queue.get()
+            self.consumer_blocked_sec += time.perf_counter() - started
+            if item is _END:
+                return
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
+
+    def _consume(self) -> None:
+        try:
+            self.result = self.write(self._batches())
+        except BaseException as e:
+            self.error = e
+            # Освобождаем очередь, чтобы сравнение не ждало места в ней
+            while True:
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    break
@@ -0,0 +1,311 @@
+import os
+import sqlite3
+from typing import Iterator, List, Optional, Sequence, Union
+
+import pandas as pd
+from openpyxl import load_workbook
+
+from custom_errors import Input_data_Error
+from formats import INPUT_FORMATS, detect_format, excel_part_path, require_pyarrow
+from text import NAME_DATA_FILE, correct_columns
+from utils import load_config
+
+# Быстрое чтение xlsx (Rust-библиотека calamine, pandas >= 2.2)
+try:
+    import python_calamine
+except ImportError:
+    python_calamine = None
+
+# Чтение Parquet и Arrow IPC
+try:
+    import pyarrow.ipc
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+# Лист с исходными данными в NAME_DATA_FILE
+DATA_SHEET_NAME = 'Sheet1'
+
+# Сколько байт начала CSV просматривается для оценки числа строк (estimate_rows)
+ESTIMATE_SAMPLE_BYTES = 2**20
+
+# Движки pandas для чтения xlsx в порядке предпочтения при 'auto'
+EXCEL_ENGINES = ('calamine', 'openpyxl')
+
+def excel_engine(engine: Optional[str] = None) -> str:
+    """
+    Движок чтения Excel: заданный (по умолчанию input_options.excel_engine
+    из конфигурации) или, при 'auto', самый быстрый из установленных.
+    Если calamine не установлен, используется openpyxl.
+    """
+    if engine is None:
+        engine = load_config().get("input_options", {}).get("excel_engine", "auto")
+    if engine == 'calamine' and python_calamine is None:
+        return 'openpyxl'
+    if engine not in EXCEL_ENGINES:
+        return 'calamine' if python_calamine is not None else 'openpyxl'
+    return engine
+
+def _as_strings(df: pd.DataFrame) -> pd.DataFrame:
+    # Столбцы Parquet и Arrow типизированы: числа приводятся к строкам, как при
+    # чтении Excel с dtype=str, пропуски остаются NaN
+    for column in df.columns:
+        values = df[column]
+        if not pd.api.types.is_string_dtype(values):
+            df[column] = values.astype(str).where(values.notna())
+    return df
+
+def _require_input_format(file_path: str, file_format: str) -> None:
+    if file_format not in INPUT_FORMATS:
+        raise ValueError(f"Формат {file_format} не поддерживается для исходных данных: {file_path}")
+
+def read_header(file_path: str) -> List[str]:
+    """Имена столбцов файла без чтения данных (для CSV, Parquet и Arrow)."""
+    file_format = detect_format(file_path)
+    _require_input_format(file_path, file_format)
+    if file_format == 'csv':
+        return list(pd.read_csv(file_path, nrows=0, encoding='utf-8-sig').columns)
+    require_pyarrow(file_path, "чтения")
+    if file_format == 'parquet':
+        return list(pq.read_schema(file_path).names)
+    with pyarrow.ipc.open_file(file_path) as reader:
+        return list(reader.schema.names)
+
+def read_data_columns(file_path: str, sheet_name: Union[str, int] = 0,
+                      columns: Sequence[str] = correct_columns,
+                      engine: Optional[str] = None) -> pd.DataFrame:
+    """
+    Читает только нужные столбцы как строки: без вывода типов и без разбора
+    остальных столбцов. Пустые ячейки остаются NaN. Формат (xlsx, CSV,
+    Parquet, Arrow IPC) определяется по расширению файла; sheet_name и
+    engine относятся только к Excel.
+    """
+    file_format = detect_format(file_path)
+    _require_input_format(file_path, file_format)
+    if file_format == 'csv':
+        # Пропуском считается только пустое поле: "NA" или "null" - обычные названия
+        return pd.read_csv(file_path, usecols=list(columns), dtype=str, encoding='utf-8-sig',
+                           keep_default_na=False, na_values=[''])
+    if file_format == 'parquet':
+        require_pyarrow(file_path, "чтения")
+        return _as_strings(pd.read_parquet(file_path, columns=list(columns)))
+    if file_format == 'arrow':
+        require_pyarrow(file_path, "чтения")
+        return _as_strings(pd.read_feather(file_path, columns=list(columns)))
+    return pd.read_excel(file_path, sheet_name=sheet_name, usecols=list(columns),
+                         dtype=str, engine=excel_engine(engine))
+
+def count_rows(file_path: str) -> int:
+    """
+    Число строк данных, если его можно узнать без чтения файла (метаданные
+    Parquet и Arrow IPC); для CSV и Excel - 0.
+    """
+    file_format = detect_format(file_path)
+    if file_format == 'parquet' and pq is not None:
+        return pq.ParquetFile(file_path).metadata.num_rows
+    if file_format == 'arrow' and pq is not None:
+        with pyarrow.ipc.open_file(pyarrow.memory_map(file_path)) as reader:
+            return sum(reader.get_batch(i).num_rows for i in range(reader.num_record_batches))
+    return 0
+
+def estimate_rows(file_path: str) -> int:
+    """
+    Оценка числа строк данных без чтения файла целиком: точное число из
+    метаданных Parquet и Arrow IPC (count_rows), для xlsx - по размеру листа
+    из его заголовка, для CSV - по размеру файла и числу переводов строки в
+    первых ESTIMATE_SAMPLE_BYTES байтах. 0, если оценить нельзя.
+    """
+    rows = count_rows(file_path)
+    if rows:
+        return rows
+    file_format = detect_format(file_path)
+    if file_format == 'csv':
+        with open(file_path, 'rb') as file:
+            sample = file.read(ESTIMATE_SAMPLE_BYTES)
+        lines = sample.count(b'\n') + (0 if sample.endswith(b'\n') else 1)
+        if len(sample) == ESTIMATE_SAMPLE_BYTES:
+            lines = int(lines * os.path.getsize(file_path) / len(sample))
+        # Первая строка - заголовок
+        return max(lines - 1, 0)
+    if file_format == 'xlsx':
+        workbook = load_workbook(file_path, read_only=True)
+        try:
+            max_row = workbook.worksheets[0].max_row
+        finally:
+            workbook.close()
+        return max(max_row - 1, 0) if max_row else 0
+    return 0
+
+def _excel_column_values(file_path: str, column: str) -> Iterator[object]:
+    # openpyxl в режиме read_only разбирает лист потоком, не загружая его целиком
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, ())
+        if column not in header:
+            raise ValueError(f"В {file_path} нет столбца {column}")
+        index = header.index(column)
+        for row in rows:
+            yield row[index] if index < len(row) else None
+    finally:
+        workbook.close()
+
+def _chunks_of(values: Iterator[object], chunk_rows: int) -> Iterator[List[str]]:
+    chunk: List[str] = []
+    for value in values:
+        # None - пустая ячейка, NaN - пропуск в числовом столбце
+        if value is None or value == '' or value != value:
+            continue
+        chunk.append(value if isinstance(value, str) else str(value))
+        if len(chunk) >= chunk_rows:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def iter_column_chunks(file_path: str, column: str, chunk_rows: int) -> Iterator[List[str]]:
+    """
+    Читает столбец потоком и выдает непустые значения строками, блоками по
+    chunk_rows. В памяти одновременно находится один блок: CSV читается
+    pandas по частям, Parquet - по группам строк, Arrow IPC - через
+    отображение файла в память, xlsx - openpyxl в режиме read_only.
+    """
+    file_format = detect_format(file_path)
+    _require_input_format(file_path, file_format)
+    if file_format == 'csv':
+        reader = pd.read_csv(file_path, usecols=[column], dtype=str, encoding='utf-8-sig',
+                             keep_default_na=False, na_values=[''], chunksize=chunk_rows)
+        with reader:
+            for frame in reader:
+                yield from _chunks_of(iter(frame[column].tolist()), chunk_rows)
+        return
+    if file_format in ('parquet', 'arrow'):
+        require_pyarrow(file_path, "чтения")
+        if file_format == 'parquet':
+            batches = pq.ParquetFile(file_path).iter_batches(batch_size=chunk_rows, columns=[column])
+        else:
+            reader = pyarrow.ipc.open_file(pyarrow.memory_map(file_path))
+            batches = (reader.get_batch(i).select([column]) for i in range(reader.num_record_batches))
+        values = (value for batch in batches for value in batch.column(0).to_pylist())
+        yield from _chunks_of(values, chunk_rows)
+        return
+    yield from _chunks_of(_excel_column_values(file_path, column), chunk_rows)
+
+def _long_results(df: pd.DataFrame) -> pd.DataFrame:
+    # Раскладка 'wide' разворачивается обратно в пары: data1 в прежнем порядке,
+    # совпадения каждого - по убыванию оценки
+    if 'data2_1' in df.columns:
+        frames = []
+        number = 1
+        while f'data2_{number}' in df.columns:
+            frame = df[['data1', f'data2_{number}', f'score_{number}']].set_axis(['data1', 'data2', 'score'], axis=1)
+            frames.append(frame[frame['data2'].notna()])
+            number += 1
+        df = pd.concat(frames).sort_index(kind='stable').reset_index(drop=True)
+    if 'score' in df.columns:
+        df['score'] = pd.to_numeric(df['score'], errors='coerce')
+    return df
+
+def read_results(file_path: str) -> pd.DataFrame:
+    """
+    Читает файл результатов прошлого запуска целиком в его формате и
+    возвращает пары data1, data2, score (в файлах до появления оценок
+    столбца score нет). Результаты в Excel собираются со всех листов и
+    книг-продолжений (см. writers.write_excel). Файл в раскладке 'wide'
+    разворачивается в пары; совпадения сверх wide_max_matches в нем не
+    сохранялись и не восстанавливаются.
+    """
+    file_format = detect_format(file_path)
+    if file_format == 'sqlite':
+        connection = sqlite3.connect(file_path)
+        try:
+            return pd.read_sql_query("SELECT data1, data2, score FROM mapping", connection)
+        finally:
+            connection.close()
+    if file_format == 'csv':
+        return _long_results(pd.read_csv(file_path, dtype=str, encoding='utf-8-sig',
+                                         keep_default_na=False, na_values=['']))
+    if file_format == 'parquet':
+        require_pyarrow(file_path, "чтения")
+        return _long_results(pd.read_parquet(file_path))
+    if file_format == 'arrow':
+        require_pyarrow(file_path, "чтения")
+        return _long_results(pd.read_feather(file_path))
+    frames = []
+    part = 1
+    while os.path.isfile(excel_part_path(file_path, part)):
+        sheets = pd.read_excel(excel_part_path(file_path, part), sheet_name=None, engine=excel_engine())
+        frames.extend(sheets.values())
+        part += 1
+    return _long_results(pd.concat(frames, ignore_index=True))
+
+def read_input_data(file_path: str, sheet_name: str = DATA_SHEET_NAME,
+                    engine: Optional[str] = None) -> pd.DataFrame:
+    """
+    Читает исходные данные и проверяет их. Книга открывается и разбирается
+    один раз: наличие листа проверяется по уже открытой книге, и тот же
+    объект читает сначала заголовок (для проверки столбцов), а затем только
+    столбцы data1 и data2 как строки. Результат можно передать в
+    create_file_matches(data=...) без повторного чтения файла.
+
+    Файлы CSV, Parquet и Arrow IPC (по расширению) читаются так же, но в них
+    допускаются и другие столбцы кроме data1 и data2.
+
+    При ошибке в данных вызывает Input_data_Error с текстом для пользователя.
+    """
+    try:
+        if detect_format(file_path) != 'xlsx':
+            validate_columns(read_header(file_path), exact=False)
+            df = read_data_columns(file_path)
+            validate_input_data(df)
+            return df
+        with pd.ExcelFile(file_path, engine=excel_engine(engine)) as excel_file:
+            if sheet_name not in excel_file.sheet_names:
+                raise Input_data_Error(f'В {NAME_DATA_FILE} отсутствует лист {sheet_name}.')
+            validate_columns(excel_file.parse(sheet_name, nrows=0).columns)
+            df = excel_file.parse(sheet_name, usecols=list(correct_columns), dtype=str)
+    except Input_data_Error:
+        raise
+    except Exception as e:
+        raise Input_data_Error(f"Ошибка чтения файла: {e}")
+
+    validate_input_data(df)
+    return df
+
+def validate_columns(columns: Sequence[str], exact: bool = True) -> None:
+    """
+    Проверяет заголовок исходных данных; при ошибке вызывает Input_data_Error.
+    exact=False разрешает столбцы помимо data1 и data2.
+    """
+
+    # 1. Проверка количества столбцов
+    if exact and len(columns) != 2:
+        raise Input_data_Error(f"""\
+В {NAME_DATA_FILE} должно быть только два столбца.
+Нажмите 📋 Открыть исходные данные, чтобы открыть для редактирования {NAME_DATA_FILE}""")
+
+    # 2. Проверка наличия необходимых столбцов
+    if not set(correct_columns).issubset(set(columns)):
+        missing_columns = set(correct_columns) - set(columns)
+        missing_columns_str = ', '.join(missing_columns)
+        raise Input_data_Error(f"""\
+В {NAME_DATA_FILE} ошибки в именах столбцов: {missing_columns_str}.
+Нажмите 📋 Открыть исходные данные, чтобы открыть для редактирования {NAME_DATA_FILE}""")
+
+def validate_input_data(df: pd.DataFrame) -> None:
+    """Проверяет столбцы и первую строку исходных данных; при ошибке вызывает Input_data_Error."""
+    validate_columns(df.columns)
+
+    # 3. Проверка заполненности первой строки (проверка на пустой файл)
+    if df.empty or df.iloc[0].isnull().all():
+        raise Input_data_Error(f"Файл {NAME_DATA_FILE} возможно пуст или не содержит данных. "
+                               f"Проверьте, заполнена ли первая строка таблицы.")
+
+    # 4. Проверка на пустые значения в первой строке
+    if df.iloc[0].isnull().any():
+        null_columns = df.iloc[0].isnull()
+        missing_columns = null_columns[null_columns].index.tolist()
+        missing_columns_str = ', '.join(missing_columns)
+        raise Input_data_Error(f"""\
+В {NAME_DATA_FILE} не заполнена первая строка таблицы в следующих столбцах: {missing_columns_str}.
+Нажмите 📋 Открыть исходные данные, чтобы открыть для редактирования {NAME_DATA_FILE}""")
@@ -11,8 +11,19 @@ NAME_APP = 'FuzzyMatchTool'
 SUB_TITLE_APP = 'мастер по поиску совпадений'
 NAME_DATA_FILE = 'data_comparison.xlsx'
 NAME_OUTPUT_FILE = 'fuzzy_mapping_results.xlsx'
+NAME_UNPROCESSED_FILE = 'unprocessed_rows.xlsx'
+NAME_CACHE_FILE = 'cleaning_cache.sqlite'
+NAME_REFERENCE_SNAPSHOT = 'reference_snapshot.arrow'
 correct_columns = ['data1', 'data2']
 
+# Подписи этапов сравнения для строки прогресса
+STAGE_LABELS = {'reading': 'Чтение данных',
+                'cleaning': 'Очистка текста',
+                'planning': 'Выбор способа поиска',
+                'matching': 'Сравнение',
+                'writing': 'Запись результатов',
+                'done': 'Готово'}
+
 TEXT_BRIEF_INTRODUCTION = '''\
 Позволяет быстро сравнить два набора текстовых значений за три шага:
     
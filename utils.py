@@ -1,7 +1,26 @@
+import hashlib
 import json
+import multiprocessing
+import os
 import re
-from typing import Dict, Any
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache, partial
+from operator import methodcaller
+from typing import Callable, Dict, Any, Iterable, List, Optional, Tuple
 from nltk.corpus import stopwords
+from rapidfuzz.utils import default_process
+
+from abbreviations import AbbreviationExpander, load_abbreviations
+from homoglyphs import HOMOGLYPH_TABLE, TRANSLITERATION_TABLE
+from legal_forms import CleanedName, LegalFormMatcher, LegalForms
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:
+    pa = None
 
 # Глобальная переменная для кэширования конфигурации
 _config_cache: Dict[str, Any] = {}
@@ -35,16 +54,58 @@ except LookupError:
 DEFAULT_CONFIG = {
     "cleaning_options": {
         "use_stemming_or_lemmatization": 1,
+        "normalizer": "pymorphy",
         "remove_legal_forms": 0,
         "remove_digits": 0, 
         "remove_punctuation": 1,
         "remove_stopwords": 1,
-        "sort_words": 1
+        "sort_words": 1,
+        "expand_abbreviations": 1,
+        "normalize_homoglyphs": 0,
+        "transliterate": 0
     },
     "comparison_options": {
         "use_token_sort_ratio": 1,
-        "similarity_score": 90
+        "similarity_score": 90,
+        "time_budget_sec": 0,
+        "max_memory_mb": 0,
+        "engine": "auto",
+        "cleaning_workers": 0,
+        "stream_chunk_rows": 0,
+        "match_legal_forms": 0
+    },
+    "cache_options": {
+        "persistent_cache": 1,
+        "max_entries": 1000000,
+        "memory_entries": 200000,
+        "reference_snapshot": 1
+    },
+    "input_options": {
+        "excel_engine": "auto",
+        "data_file": "",
+        "reference_file": "",
+        "format": "auto"
+    },
+    "output_options": {
+        "output_file": "",
+        "format": "auto",
+        "parquet_row_group_rows": 100000,
+        "excel_overflow": "sheets",
+        "writer_queue_batches": 8,
+        "layout": "long",
+        "wide_max_matches": 10
+    },
+    "abbreviations": {
+        "подсол.": "подсолнечный", "ул.": "улица", "тов.": "товарищество", "просп.": "проспект",
+        "пр-т": "проспект", "обл.": "область", "р-н": "район", "пр-во": "производство",
+        "произв.": "производственный", "предпр.": "предприятие", "комп.": "компания",
+        "упр.": "управление", "ф-ка": "фабрика", "з-д": "завод", "им.": "имени", "кооп.": "кооператив",
+        "торг.": "торговый", "гос.": "государственный", "муниц.": "муниципальный"
     },
+    "abbreviations_file": "",
+    "legal_forms": ["ООО", "ОАО", "АО", "ЗАО", "ПФ", "ПАО", "L.L.C", "ИП", "ТОО", "Ltd", "Co.", "НП", "СО", "КП",
+                    "ФК", "ГК", "LLP", "PLC", "S.A.", "S.R.L.", "GmbH", "B.V.", "Inc.", "Corp.", "S.p.A.", "Pty Ltd",
+                    "SAS", "N.V."],
     "legal_forms_regex": "(?i)\\b(ООО|ОАО|АО|ЗАО|ПФ|ПАО|L.L.C|ИП|ТОО|Ltd|Co.НП|СО|КП|ФК|ГК|ЗАО|ОАО|ПАО|ИП|ТОО|LLP|PLC|S.A.|S.R.L.|GmbH|B.V.|Inc.|Corp.|S.p.A.|Pty Ltd|SAS|N.V.)\\b"
 }
 
@@ -142,14 +203,162 @@ def load_config(file_path: str = CONFIG_FILE_PATH) -> Dict[str, Any]:
 # Инициализация лемматизатора (если pymorphy2 не установлен, будет использоваться заглушка)
 try:
     from pymorphy3 import MorphAnalyzer
-    morph = MorphAnalyzer()
-    def lemmatize_word(word: str) -> str:
-        return morph.parse(word)[0].normal_form
 except ImportError:
+    MorphAnalyzer = None
     print("Предупреждение: pymorphy2 не установлен. Лемматизация будет пропущена.")
+
+# Анализатор создается при первом обращении (см. get_morph), а в процессах
+# пула очистки - один раз в инициализаторе процесса
+morph = None
+
+def get_morph():
+    """Возвращает MorphAnalyzer процесса, загружая словари при первом вызове."""
+    global morph
+    if morph is None:
+        morph = MorphAnalyzer()
+    return morph
+
+if MorphAnalyzer is not None:
+    def lemmatize_word(word: str) -> str:
+        analyzer = morph if morph is not None else get_morph()
+        return analyzer.parse(word)[0].normal_form
+else:
     def lemmatize_word(word: str) -> str:
         return word # Заглушка
 
+try:
+    # PyStemmer - реализация Snowball на C, заметно быстрее стеммера из nltk
+    import Stemmer
+except ImportError:
+    Stemmer = None
+
+class WordNormalizer:
+    """
+    Способ приведения слов к общей форме перед сравнением (см. NORMALIZERS).
+    Словари загружаются в load(), а не при импорте модуля.
+    """
+
+    name = 'none'
+    title = 'Без нормализации'
+    # Стоит ли нормализовать большой словарь в пуле процессов
+    parallel = False
+
+    @property
+    def implementation(self) -> str:
+        """Идентификатор реализации для отпечатка настроек очистки."""
+        return self.name
+
+    def load(self) -> Callable[[str], str]:
+        """Загружает словари (один раз на процесс) и возвращает функцию нормализации слова."""
+        return str
+
+class PymorphyNormalizer(WordNormalizer):
+    """Лемматизация pymorphy3: точная, но медленная и с тяжелыми словарями."""
+
+    name = 'pymorphy'
+    title = 'Лемматизация pymorphy3'
+    parallel = True
+
+    @property
+    def implementation(self) -> str:
+        return self.name if MorphAnalyzer is not None else WordNormalizer.name
+
+    def load(self) -> Callable[[str], str]:
+        if MorphAnalyzer is not None:
+            get_morph()
+        return lemmatize_word
+
+class SnowballNormalizer(WordNormalizer):
+    """Стемминг Snowball для русского: отсекает окончания без словаря, быстро загружается."""
+
+    name = 'snowball'
+    title = 'Стемминг Snowball'
+
+    def __init__(self) -> None:
+        self._stem: Optional[Callable[[str], str]] = None
+
+    @property
+    def implementation(self) -> str:
+        return 'snowball-pystemmer' if Stemmer is not None else 'snowball-nltk'
+
+    def load(self) -> Callable[[str], str]:
+        if self._stem is None:
+            if Stemmer is not None:
+                self._stem = Stemmer.Stemmer('russian').stemWord
+            else:
+                from nltk.stem.snowball import SnowballStemmer
+                self._stem = SnowballStemmer('russian').stem
+        return self._stem
+
+NORMALIZERS = {normalizer.name: normalizer for normalizer in (PymorphyNormalizer, SnowballNormalizer, WordNormalizer)}
+
+# Экземпляры нормализаторов процесса: словари загружаются один раз
+_normalizers: Dict[str, WordNormalizer] = {}
+
+def get_normalizer(config_or_name: Any) -> WordNormalizer:
+    """
+    Нормализатор по имени или по конфигурации: cleaning_options.normalizer,
+    а при выключенной use_stemming_or_lemmatization - без нормализации.
+    """
+    if isinstance(config_or_name, str):
+        name = config_or_name
+    else:
+        options = config_or_name.get("cleaning_options", {})
+        name = options.get("normalizer", PymorphyNormalizer.name) \
+            if options.get("use_stemming_or_lemmatization", 0) == 1 else WordNormalizer.name
+    if name not in NORMALIZERS:
+        name = PymorphyNormalizer.name
+    if name not in _normalizers:
+        _normalizers[name] = NORMALIZERS[name]()
+    return _normalizers[name]
+
+# Размер словаря уникальных слов, начиная с которого нормализация идет в пуле
+# процессов: на меньших объемах запуск процессов обходится дороже самой работы
+PARALLEL_MIN_WORDS = 20_000
+
+def cleaning_workers(config: Dict[str, Any]) -> int:
+    """Число процессов для лемматизации: comparison_options.cleaning_workers, 0 - по числу ядер."""
+    workers = int(config.get("comparison_options", {}).get("cleaning_workers", 0))
+    return workers if workers > 0 else (os.cpu_count() or 1)
+
+def _pool_context():
+    # На Linux - fork: словари pymorphy3, уже загруженные в родительском процессе,
+    # достаются процессам пула copy-on-write без повторной загрузки.
+    # На Windows и macOS fork недоступен или небезопасен - spawn
+    return multiprocessing.get_context('fork' if sys.platform.startswith('linux') else 'spawn')
+
+def _init_normalizer_worker(name: str) -> None:
+    """Инициализатор процесса пула: словари нормализатора загружаются один раз на процесс."""
+    get_normalizer(name).load()
+
+def _normalize_words(name: str, words: List[str]) -> List[str]:
+    normalize = get_normalizer(name).load()
+    return [normalize(word) for word in words]
+
+def normalize_vocabulary(words: List[str], normalizer: WordNormalizer, workers: int = 1) -> Dict[str, str]:
+    """
+    Нормальные формы для списка уникальных слов. При workers > 1 и большом
+    словаре медленный нормализатор (pymorphy3) работает в пуле процессов:
+    слова делятся на части; если пул запустить не удалось, нормализация
+    выполняется в текущем процессе.
+    """
+    # Словари загружаются до запуска пула, чтобы при fork их унаследовали все процессы
+    normalize = normalizer.load()
+    if workers > 1 and len(words) >= PARALLEL_MIN_WORDS and normalizer.parallel:
+        # По несколько частей на процесс, чтобы процессы заканчивали примерно одновременно
+        chunk_size = -(-len(words) // (workers * 4))
+        chunks = [words[start:start + chunk_size] for start in range(0, len(words), chunk_size)]
+        try:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=_pool_context(),
+                                     initializer=_init_normalizer_worker,
+                                     initargs=(normalizer.name,)) as pool:
+                normal_forms = [form for chunk in pool.map(partial(_normalize_words, normalizer.name), chunks)
+                                for form in chunk]
+            return dict(zip(words, normal_forms))
+        except (OSError, BrokenProcessPool):
+            pass
+    return {word: normalize(word) for word in words}
+
 def clean_text_optimized(text: str, config: Dict[str, Any]) -> str:
     """
     Оптимизированная функция очистки текста с использованием опциональных параметров.
@@ -157,11 +366,25 @@ def clean_text_optimized(text: str, config: Dict[str, Any]) -> str:
     options = config.get("cleaning_options", {})
     text = text.lower()
     
+    # 0. Латинские двойники кириллических букв -> кириллица (один проход str.translate)
+    homoglyph_table = _homoglyph_table(config)
+    if homoglyph_table is not None:
+        text = text.translate(homoglyph_table)
+    
     # 1. Удаление организационно-правовых форм (ОПФ)
     if options.get("remove_legal_forms", 0) == 1:
-        regex = config.get("legal_forms_regex", "")
-        if regex:
-            text = re.sub(regex, ' ', text)
+        legal_form_matcher = build_legal_form_matcher(config)
+        if legal_form_matcher is not None:
+            text = legal_form_matcher.strip(text)
+        else:
+            regex = config.get("legal_forms_regex", "")
+            if regex:
+                text = re.sub(regex, ' ', text)
+    
+    # 1.1. Раскрытие сокращений (до удаления знаков препинания: точка - часть сокращения)
+    abbreviation_expander = build_abbreviation_expander(config)
+    if abbreviation_expander is not None:
+        text = abbreviation_expander.expand(text)
             
     # 2. Удаление цифр
     if options.get("remove_digits", 0) == 1:
@@ -183,11 +406,18 @@ def clean_text_optimized(text: str, config: Dict[str, Any]) -> str:
     
     # 6. Удаление стоп-слов
     if options.get("remove_stopwords", 1) == 1:
-        words = [word for word in words if word not in RUSSIAN_STOPWORDS]
+        stop_words = _stop_words(homoglyph_table is not None)
+        words = [word for word in words if word not in stop_words]
         
     # 7. Лемматизация/Стемминг
-    if options.get("use_stemming_or_lemmatization", 0) == 1:
-        words = [lemmatize_word(word) for word in words]
+    normalizer = get_normalizer(config)
+    if normalizer.name != WordNormalizer.name:
+        normalize = normalizer.load()
+        words = [normalize(word) for word in words]
+        
+    # 7.1. Транслитерация латиницей (после лемматизации, которой нужна кириллица)
+    if options.get("transliterate", 0) == 1:
+        words = " ".join(words).translate(TRANSLITERATION_TABLE).split()
         
     # 8. Сортировка слов
     if options.get("sort_words", 1) == 1:
@@ -195,6 +425,394 @@ def clean_text_optimized(text: str, config: Dict[str, Any]) -> str:
         
     return " ".join(words)
 
+def _homoglyph_table(config: Dict[str, Any]) -> Optional[Dict[int, str]]:
+    """Таблица замены латинских двойников кириллицей, если нормализация включена."""
+    if config.get("cleaning_options", {}).get("normalize_homoglyphs", 0) == 1:
+        return HOMOGLYPH_TABLE
+    return None
+
+@lru_cache(maxsize=2)
+def _stop_words(normalize_homoglyphs: bool) -> frozenset:
+    """Стоп-слова в том же виде, что и текст после нормализации двойников (ё -> е)."""
+    if not normalize_homoglyphs:
+        return frozenset(RUSSIAN_STOPWORDS)
+    return frozenset(word.translate(HOMOGLYPH_TABLE) for word in RUSSIAN_STOPWORDS)
+
+def uses_legal_form_list(config: Dict[str, Any]) -> bool:
+    """
+    ОПФ задаются списком legal_forms (поиск автоматом, см. legal_forms.py).
+    В старых конфигурациях списка нет, и используется legal_forms_regex.
+    """
+    return isinstance(config.get("legal_forms"), list)
+
+@lru_cache(maxsize=8)
+def _legal_form_matcher(forms: Tuple[str, ...], normalize_homoglyphs: bool) -> LegalFormMatcher:
+    return LegalFormMatcher(forms, HOMOGLYPH_TABLE if normalize_homoglyphs else None)
+
+def detects_legal_forms(config: Dict[str, Any]) -> bool:
+    """
+    Очистка ищет ОПФ по списку legal_forms: они удаляются из текста
+    (cleaning_options.remove_legal_forms) и/или сравниваются при поиске пар
+    (comparison_options.match_legal_forms). По умолчанию обе опции выключены.
+    """
+    if not uses_legal_form_list(config):
+        return False
+    return (config.get("cleaning_options", {}).get("remove_legal_forms", 0) == 1
+            or config.get("comparison_options", {}).get("match_legal_forms", 0) == 1)
+
+def build_legal_form_matcher(config: Dict[str, Any]) -> Optional[LegalFormMatcher]:
+    """Автомат поиска ОПФ по списку legal_forms; None, если формы не ищутся (см. detects_legal_forms)."""
+    if not detects_legal_forms(config):
+        return None
+    return _legal_form_matcher(tuple(config["legal_forms"]), _homoglyph_table(config) is not None)
+
+def _abbreviations_file_state(config: Dict[str, Any]) -> Optional[Tuple[str, int, int]]:
+    """(путь, время изменения, размер) словаря сокращений пользователя или None, если файла нет."""
+    path = config.get("abbreviations_file", "")
+    if not path:
+        return None
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return path, stat.st_mtime_ns, stat.st_size
+
+@lru_cache(maxsize=8)
+def _abbreviation_expander(abbreviations: Tuple[Tuple[str, str], ...],
+                           file_state: Optional[Tuple[str, int, int]],
+                           normalize_homoglyphs: bool) -> AbbreviationExpander:
+    expander = AbbreviationExpander(dict(abbreviations), HOMOGLYPH_TABLE if normalize_homoglyphs else None)
+    if file_state is not None:
+        for short, full in load_abbreviations(file_state[0]).items():
+            expander.add(short, full)
+    return expander
+
+def build_abbreviation_expander(config: Dict[str, Any]) -> Optional[AbbreviationExpander]:
+    """
+    Префиксное дерево сокращений из abbreviations и файла abbreviations_file
+    (записи файла дополняют и переопределяют словарь из конфигурации).
+    None, если раскрытие сокращений выключено. Отсутствующий файл пропускается.
+    """
+    if config.get("cleaning_options", {}).get("expand_abbreviations", 0) != 1:
+        return None
+    expander = _abbreviation_expander(tuple(sorted(config.get("abbreviations", {}).items())),
+                                      _abbreviations_file_state(config),
+                                      _homoglyph_table(config) is not None)
+    return expander if len(expander) else None
+
+# Глобальный флаг в начале регулярного выражения, например (?i)
+_GLOBAL_FLAGS_RE = re.compile(r'^\(\?([aiLmsux]+)\)')
+
+def _compile_removal_pattern(config: Dict[str, Any]) -> Optional["re.Pattern[str]"]:
+    """
+    Объединяет удаление ОПФ, цифр и знаков препинания в одно регулярное
+    выражение. Результат совпадает с последовательными re.sub из
+    clean_text_optimized: формы юр.лиц начинаются с буквы, поэтому цифры и
+    знаки препинания не могут "съесть" начало формы.
+    """
+    options = config.get("cleaning_options", {})
+    parts = []
+    
+    # При списке legal_forms формы удаляются автоматом до этого выражения
+    if options.get("remove_legal_forms", 0) == 1 and not uses_legal_form_list(config):
+        regex = config.get("legal_forms_regex", "")
+        if regex:
+            # Глобальные флаги допустимы только в начале всего выражения,
+            # поэтому превращаем их в локальные для своей части
+            flags = _GLOBAL_FLAGS_RE.match(regex)
+            if flags:
+                regex = f"(?{flags.group(1)}:{regex[flags.end():]})"
+            parts.append(regex)
+    
+    if options.get("remove_digits", 0) == 1:
+        parts.append(r'\d+')
+    
+    if options.get("remove_punctuation", 1) == 1:
+        # "_" входит в \w, но rapidfuzz.utils.default_process считает его разделителем
+        parts.append(r'[^\w\s]|_')
+    
+    return re.compile("|".join(parts)) if parts else None
+
+def _build_tokenizer(config: Dict[str, Any]) -> Callable[[str], Tuple[List[str], LegalForms]]:
+    """
+    Первая часть очистки: нижний регистр, удаление по регулярному выражению,
+    слова без стоп-слов. Вместе со словами возвращает найденные ОПФ (пустой
+    кортеж, если формы не ищутся).
+    """
+    options = config.get("cleaning_options", {})
+    homoglyph_table = _homoglyph_table(config)
+    legal_form_matcher = build_legal_form_matcher(config)
+    remove_legal_forms = options.get("remove_legal_forms", 0) == 1
+    abbreviation_expander = build_abbreviation_expander(config)
+    removal_sub = None
+    pattern = _compile_removal_pattern(config)
+    if pattern is not None:
+        removal_sub = pattern.sub
+    stop_words = _stop_words(homoglyph_table is not None) if options.get("remove_stopwords", 1) == 1 else None
+    
+    def tokenize(text: str) -> Tuple[List[str], LegalForms]:
+        text = text.lower()
+        if homoglyph_table is not None:
+            text = text.translate(homoglyph_table)
+        legal_forms = ()
+        if legal_form_matcher is not None:
+            stripped, legal_forms = legal_form_matcher.split(text)
+            if remove_legal_forms:
+                text = stripped
+        if abbreviation_expander is not None:
+            text = abbreviation_expander.expand(text)
+        if removal_sub is not None:
+            text = removal_sub(' ', text)
+        
+        # split() без аргументов сразу схлопывает и обрезает пробелы
+        words = text.split()
+        if stop_words is not None:
+            words = [word for word in words if word not in stop_words]
+        return words, legal_forms
+    
+    return tokenize
+
+# Строковые функции Arrow используют RE2, где \w, \d, \s и \b знают только ASCII,
+# а нижний регистр считает utf8proc. На строках из ASCII и основной кириллицы
+# они совпадают с модулем re и str.lower(), поэтому на колоночный путь
+# попадают только такие строки (плюс типографские знаки вроде «», — и №),
+# а классы символов записаны явно
+_ARROW_LETTERS = r"A-Za-z\x{0401}\x{0410}-\x{044f}\x{0451}"
+_ARROW_SPACES = r"\x09-\x0d\x20\x{00a0}"
+_ARROW_PUNCTUATION = r"\x21-\x2f\x3a-\x40\x5b-\x60\x7b-\x7e\x{00ab}\x{00bb}\x{2013}\x{2014}\x{201c}-\x{201e}\x{2026}\x{2116}"
+_ARROW_UNSAFE_RE = rf"[^0-9{_ARROW_LETTERS}{_ARROW_SPACES}{_ARROW_PUNCTUATION}]"
+
+# Больше сокращений или форм в одном выражении RE2 строит автомат слишком долго:
+# тогда шаг на Python выполняется для каждой строки
+ARROW_PREFILTER_MAX_PATTERNS = 500
+
+def _arrow_literals(literals: Iterable[str]) -> Optional[str]:
+    """
+    Выражение RE2, находящее любую из строк literals как подстроку; None, если
+    строк нет или их больше ARROW_PREFILTER_MAX_PATTERNS. Все знаки, кроме
+    букв и цифр, записываются кодом (\\x{...}), чтобы не разбирать правила
+    экранирования RE2.
+    """
+    literals = list(literals)
+    if not literals or len(literals) > ARROW_PREFILTER_MAX_PATTERNS:
+        return None
+    return "|".join("".join(char if char.isalnum() else f"\\x{{{ord(char):x}}}" for char in literal)
+                    for literal in literals)
+
+def _build_column_tokenizer(config: Dict[str, Any]) -> Optional[Callable[[List[str]], Tuple[List[List[str]], List[LegalForms]]]]:
+    """
+    Колоночный вариант _build_tokenizer на строковых функциях pyarrow:
+    нижний регистр и удаление цифр и знаков препинания выполняются сразу для
+    всего списка, в Python остается только разбиение на слова (split()
+    заодно схлопывает пробелы) и удаление стоп-слов.
+    
+    Поиск ОПФ автоматом и раскрытие сокращений на Python выполняются не
+    для всех строк, а только для тех, где выражение RE2 нашло хотя бы одну
+    форму или сокращение как подстроку: остальные строки эти шаги не меняют
+    и форм в них нет. Замена двойников и legal_forms_regex (для модуля re)
+    по-прежнему идут по каждой строке. Результат - слова и найденные ОПФ
+    для каждой строки - совпадает с _build_tokenizer: строки с символами
+    вне ASCII и основной кириллицы обрабатываются им же.
+    Возвращает None, если pyarrow не установлен.
+    """
+    if pa is None:
+        return None
+    options = config.get("cleaning_options", {})
+    tokenize = _build_tokenizer(config)
+    homoglyph_table = _homoglyph_table(config)
+    # Шаги на Python после нижнего регистра: (шаг, выражение RE2 для отбора строк или None - все строки).
+    # Шаг None - поиск ОПФ (find_legal_forms): он еще и запоминает найденные формы
+    python_steps: List[Tuple[Optional[Callable[[str], str]], Optional[str]]] = []
+    if homoglyph_table is not None:
+        python_steps.append((methodcaller('translate', homoglyph_table), None))
+    legal_form_matcher = build_legal_form_matcher(config)
+    remove_legal_forms = options.get("remove_legal_forms", 0) == 1
+    if legal_form_matcher is not None:
+        python_steps.append((None, _arrow_literals(legal_form_matcher.patterns)))
+    elif remove_legal_forms and not uses_legal_form_list(config) and config.get("legal_forms_regex", ""):
+        python_steps.append((partial(re.compile(config["legal_forms_regex"]).sub, ' '), None))
+    abbreviation_expander = build_abbreviation_expander(config)
+    if abbreviation_expander is not None:
+        python_steps.append((abbreviation_expander.expand, _arrow_literals(abbreviation_expander.shorts())))
+    parts = []
+    if options.get("remove_digits", 0) == 1:
+        parts.append(r'[0-9]+')
+    if options.get("remove_punctuation", 1) == 1:
+        parts.append(rf'[^0-9{_ARROW_LETTERS}{_ARROW_SPACES}]|_')
+    removal_pattern = "|".join(parts)
+    stop_words = _stop_words(homoglyph_table is not None) if options.get("remove_stopwords", 1) == 1 else None
+    
+    def find_legal_forms(column: "pa.StringArray", pattern: Optional[str],
+                         legal_forms: List[LegalForms]) -> "pa.StringArray":
+        """Запоминает ОПФ строк column в legal_forms и, если нужно, удаляет их из текста."""
+        if pattern is None:
+            rows = range(len(column))
+            selected = column
+            mask = None
+        else:
+            mask = pc.match_substring_regex(column, pattern)
+            if not mask.true_count:
+                return column
+            rows = pc.indices_nonzero(mask).to_pylist()
+            selected = pc.filter(column, mask)
+        stripped = []
+        for row, text in zip(rows, selected.to_pylist()):
+            text, legal_forms[row] = legal_form_matcher.split(text)
+            stripped.append(text)
+        if not remove_legal_forms:
+            return column
+        if mask is None:
+            return pa.array(stripped, type=pa.string())
+        return pc.replace_with_mask(column, mask, pa.array(stripped, type=pa.string()))
+    
+    def tokenize_column(texts: List[str]) -> Tuple[List[List[str]], List[LegalForms]]:
+        if not texts:
+            return [], []
+        column = pa.array(texts, type=pa.string())
+        unsafe = pc.match_substring_regex(column, _ARROW_UNSAFE_RE)
+        column = pc.utf8_lower(column)
+        legal_forms: List[LegalForms] = [()] * len(texts)
+        for step, pattern in python_steps:
+            if step is None:
+                column = find_legal_forms(column, pattern, legal_forms)
+                continue
+            if pattern is None:
+                column = pa.array([step(text) for text in column.to_pylist()], type=pa.string())
+                continue
+            # Строки без единого совпадения шаг не меняет
+            mask = pc.match_substring_regex(column, pattern)
+            if mask.true_count:
+                changed = [step(text) for text in pc.filter(column, mask).to_pylist()]
+                column = pc.replace_with_mask(column, mask, pa.array(changed, type=pa.string()))
+        if python_steps:
+            # Символы проверяются и после подстановок: полные формы сокращений тоже попадают в RE2
+            unsafe = pc.or_(unsafe, pc.match_substring_regex(column, _ARROW_UNSAFE_RE))
+        if removal_pattern:
+            column = pc.replace_substring_regex(column, removal_pattern, ' ')
+        
+        result = []
+        for row, (text, original, is_unsafe) in enumerate(zip(column.to_pylist(), texts, unsafe.to_pylist())):
+            if is_unsafe:
+                words, legal_forms[row] = tokenize(original)
+                result.append(words)
+                continue
+            words = text.split()
+            if stop_words is not None:
+                words = [word for word in words if word not in stop_words]
+            result.append(words)
+        return result, legal_forms
+    
+    return tokenize_column
+
+def _build_finisher(config: Dict[str, Any]) -> Callable[[List[str]], str]:
+    """Последняя часть очистки: транслитерация, сортировка слов, сборка строки и нормализация для rapidfuzz."""
+    options = config.get("cleaning_options", {})
+    transliterate = options.get("transliterate", 0) == 1
+    sort_words = options.get("sort_words", 1) == 1
+    # Если знаки препинания не удаляются, они остаются внутри слов
+    # и нормализуются уже после сборки строки, как в default_process
+    keep_punctuation = options.get("remove_punctuation", 1) != 1
+    
+    def finish(words: List[str]) -> str:
+        if transliterate:
+            # Одна строка - один вызов str.translate; "ь" дает пустые слова, split() их убирает
+            words = " ".join(words).translate(TRANSLITERATION_TABLE).split()
+        if sort_words:
+            words.sort()
+        text = " ".join(words)
+        return default_process(text) if keep_punctuation else text
+    
+    return finish
+
+def build_cleaner(config: Dict[str, Any], legal_forms: bool = False) -> Callable[[str], Any]:
+    """
+    Создает функцию очистки, специализированную под конфигурацию.
+    
+    Опции читаются один раз, регулярные выражения компилируются заранее и
+    объединяются в один проход. Результат уже нормализован так же, как
+    rapidfuzz.utils.default_process, поэтому повторная обработка перед
+    сравнением не нужна: cleaner(text) == default_process(clean_text_optimized(text, config)).
+    
+    Исключение - строки с "_": здесь он разделяет слова еще до удаления
+    стоп-слов, лемматизации и сортировки, а в clean_text_optimized остается
+    внутри слова до default_process. Поэтому части "ооо_ромашка" проходят
+    лемматизацию и сортировку как отдельные слова.
+    
+    При legal_forms=True функция возвращает CleanedName: очищенный текст и
+    ОПФ, найденные в исходном тексте (см. detects_legal_forms).
+    """
+    tokenize = _build_tokenizer(config)
+    finish = _build_finisher(config)
+    normalizer = get_normalizer(config)
+    lemmatize = normalizer.load() if normalizer.name != WordNormalizer.name else None
+    
+    def cleaner(text: str) -> Any:
+        words, found_forms = tokenize(text)
+        if lemmatize is not None:
+            words = [lemmatize(word) for word in words]
+        if legal_forms:
+            return CleanedName(finish(words), found_forms)
+        return finish(words)
+    
+    return cleaner
+
+def build_batch_cleaner(config: Dict[str, Any], workers: Optional[int] = None,
+                        legal_forms: bool = False) -> Callable[[Iterable[str]], List[Any]]:
+    """
+    Создает функцию пакетной очистки с тем же результатом, что у build_cleaner.
+    
+    Сначала все строки разбиваются на слова, затем каждое уникальное слово
+    нормализуется ровно один раз (morph.parse - самая медленная часть
+    очистки, а слова вроде "ооо" и "компания" повторяются тысячи раз),
+    и только потом слова заменяются по таблице нормальных форм. Большой словарь
+    лемматизируется в workers процессах (по умолчанию - cleaning_workers(config)).
+    Если установлен pyarrow, разбиение на слова выполняется по всему списку
+    сразу (см. _build_column_tokenizer). legal_forms=True - как у build_cleaner.
+    """
+    tokenize = _build_tokenizer(config)
+    tokenize_column = _build_column_tokenizer(config)
+    finish = _build_finisher(config)
+    normalizer = get_normalizer(config)
+    use_lemmatization = normalizer.name != WordNormalizer.name
+    if workers is None:
+        workers = cleaning_workers(config)
+    
+    def batch_cleaner(texts: Iterable[str]) -> List[Any]:
+        if tokenize_column is not None:
+            tokenized, found_forms = tokenize_column(list(texts))
+        else:
+            tokenized, found_forms = [], []
+            for text in texts:
+                words, forms = tokenize(text)
+                tokenized.append(words)
+                found_forms.append(forms)
+        if use_lemmatization:
+            vocabulary = {word for words in tokenized for word in words}
+            lemmas = normalize_vocabulary(list(vocabulary), normalizer, workers)
+            tokenized = [[lemmas[word] for word in words] for words in tokenized]
+        if legal_forms:
+            return [CleanedName(finish(words), forms) for words, forms in zip(tokenized, found_forms)]
+        return [finish(words) for words in tokenized]
+    
+    return batch_cleaner
+
+# Версия алгоритма очистки: увеличивается при изменениях, влияющих на результат,
+# чтобы записи постоянного кэша от прежних версий не использовались
+CLEANER_VERSION = 3
+
+def cleaning_fingerprint(config: Dict[str, Any]) -> str:
+    """Отпечаток всех настроек, от которых зависит результат очистки."""
+    payload = json.dumps({"version": CLEANER_VERSION,
+                          "cleaning_options": config.get("cleaning_options", {}),
+                          "normalizer": get_normalizer(config).implementation,
+                          "legal_forms": config.get("legal_forms"),
+                          "legal_form_detection": detects_legal_forms(config),
+                          "abbreviations": config.get("abbreviations"),
+                          "abbreviations_file": _abbreviations_file_state(config),
+                          "legal_forms_regex": config.get("legal_forms_regex", "")},
+                         sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
 # Добавляем функцию для очистки кэша, чтобы можно было перечитать конфиг
 def clear_config_cache():
     global _config_cache
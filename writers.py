@@ -0,0 +1,421 @@
+import csv
+import os
+import sqlite3
+import pandas as pd
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+from custom_errors import Sheet_too_large_Error
+from formats import detect_format, excel_part_path, replaced_on_success, require_pyarrow
+
+# Запись Parquet и Arrow IPC
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# Быстрая потоковая запись xlsx; без нее используется openpyxl в режиме write_only
+try:
+    import xlsxwriter
+    from xlsxwriter.exceptions import FileCreateError
+except ImportError:
+    xlsxwriter = None
+
+# Пакет совпадений: кортежи (data1, data2, score)
+MatchBatch = List[Tuple[str, str, float]]
+
+# Пакет строк файла результатов: кортежи значений в порядке столбцов (см. result_columns)
+RowBatch = List[Tuple]
+
+# Раскладка результатов: 'long' - строка на пару (data1, data2, score),
+# 'wide' - строка на data1, совпадения в столбцах data2_1, score_1, data2_2 ...
+OUTPUT_LAYOUTS = ('long', 'wide')
+
+# Сколько совпадений помещается в строку раскладки 'wide' по умолчанию
+WIDE_MAX_MATCHES = 10
+
+# Предел строк на листе Excel (вместе со строкой заголовка)
+EXCEL_MAX_ROWS = 1_048_576
+
+# Режимы записи результатов, не помещающихся на один лист Excel (см. write_excel)
+EXCEL_OVERFLOW_MODES = ('sheets', 'files', 'error')
+
+# Строк в группе строк Parquet (и в пакете Arrow IPC): столько пар
+# накапливается в памяти, прежде чем уйти в файл
+PARQUET_ROW_GROUP_ROWS = 100_000
+
+class WrittenResults(NamedTuple):
+    """Итог записи результатов."""
+    pairs: int    # записано пар (data1, data2)
+    rows: int     # строк в файле без заголовка; в раскладке 'wide' - число data1
+
+def result_columns(layout: str = 'long', max_matches: int = WIDE_MAX_MATCHES) -> List[str]:
+    """
+    Столбцы файла результатов. 'long': data1, data2, score. 'wide': data1,
+    matches (сколько всего совпадений найдено), затем max_matches пар
+    столбцов data2_N, score_N.
+    """
+    if layout not in OUTPUT_LAYOUTS:
+        raise ValueError(f"Неизвестная раскладка результатов: {layout}")
+    if layout == 'long':
+        return ['data1', 'data2', 'score']
+    if max_matches < 1:
+        raise ValueError("wide_max_matches должно быть не меньше 1")
+    columns = ['data1', 'matches']
+    for number in range(1, max_matches + 1):
+        columns += [f'data2_{number}', f'score_{number}']
+    return columns
+
+def _best_first(match: Tuple[str, Optional[float]]) -> float:
+    # Совпадения без оценки (результаты старых запусков) - в конце
+    score = match[1]
+    return -score if score is not None else float('inf')
+
+def _wide_row(data1: str, matches: List[Tuple[str, Optional[float]]], max_matches: int) -> Tuple:
+    matches.sort(key=_best_first)
+    row: List[object] = [data1, len(matches)]
+    for data2, score in matches[:max_matches]:
+        row += [data2, score]
+    row += [None, None] * (max_matches - min(len(matches), max_matches))
+    return tuple(row)
+
+def wide_rows(batches: Iterable[MatchBatch], max_matches: int = WIDE_MAX_MATCHES) -> Iterator[RowBatch]:
+    """
+    Собирает пары в строки раскладки 'wide': одна строка на data1, первые
+    max_matches совпадений по убыванию оценки. Пары одного data1 должны идти
+    подряд - так их выдает comparison.iter_matches; если они разделены
+    (повтор data1 в разных блоках потокового режима), data1 займет несколько строк.
+    """
+    rows: RowBatch = []
+    data1: Optional[str] = None
+    matches: List[Tuple[str, Optional[float]]] = []
+    for batch in batches:
+        for value1, data2, score in batch:
+            if value1 != data1:
+                if matches:
+                    rows.append(_wide_row(data1, matches, max_matches))
+                data1, matches = value1, []
+            matches.append((data2, score))
+        if rows:
+            yield rows
+            rows = []
+    if matches:
+        yield [_wide_row(data1, matches, max_matches)]
+
+def write_results(batches: Iterable[MatchBatch], file_path: str,
+                  row_group_rows: int = PARQUET_ROW_GROUP_ROWS,
+                  excel_overflow: str = 'sheets',
+                  layout: str = 'long',
+                  max_matches: int = WIDE_MAX_MATCHES) -> WrittenResults:
+    """
+    Записывает совпадения в файл в формате, определяемом по расширению:
+    xlsx, CSV, Parquet, Arrow IPC или SQLite.
+    excel_overflow - режим переполнения листа для xlsx (см. write_excel),
+    layout и max_matches - раскладка строк (см. result_columns). В SQLite
+    пары хранятся в таблицах при любой раскладке (см. write_sqlite).
+    """
+    columns = result_columns(layout, max_matches)
+    file_format = detect_format(file_path)
+    if file_format == 'sqlite':
+        pairs = write_sqlite(batches, file_path)
+        return WrittenResults(pairs, pairs)
+    
+    pairs = 0
+    
+    def counted() -> Iterator[MatchBatch]:
+        nonlocal pairs
+        for batch in batches:
+            pairs += len(batch)
+            yield batch
+    
+    rows_batches = wide_rows(counted(), max_matches) if layout == 'wide' else counted()
+    if file_format == 'csv':
+        rows = write_csv(rows_batches, file_path, columns)
+    elif file_format == 'parquet':
+        rows = write_parquet(rows_batches, file_path, row_group_rows, columns)
+    elif file_format == 'arrow':
+        rows = write_arrow(rows_batches, file_path, row_group_rows, columns)
+    else:
+        rows = write_excel(rows_batches, file_path, excel_overflow, columns)
+    return WrittenResults(pairs, rows)
+
+def write_excel(batches: Iterable[RowBatch], file_path: str, overflow: str = 'sheets',
+                columns: Sequence[str] = ('data1', 'data2', 'score'),
+                engine: Optional[str] = None) -> int:
+    """
+    Записывает строки результатов из генератора пакетов в Excel-файл.
+    Возвращает количество записанных строк.
+    
+    Строки уходят в файл по мере поступления пакетов: xlsxwriter в режиме
+    constant_memory держит в памяти одну строку листа, openpyxl в режиме
+    write_only - сжатый поток XML. Память на экспорт не зависит от числа
+    результатов.
+    
+    overflow - что делать, когда строки не помещаются на лист Excel:
+    'sheets' - продолжать на следующем листе (Sheet2, Sheet3 ...) той же книги,
+    'files' - продолжать в следующей книге (имя_2.xlsx, имя_3.xlsx ...),
+    'error' - вызвать Sheet_too_large_Error, файл при этом не создается.
+    
+    engine - 'xlsxwriter' или 'openpyxl'; по умолчанию xlsxwriter, если установлен.
+    """
+    if overflow not in EXCEL_OVERFLOW_MODES:
+        raise ValueError(f"Неизвестный режим excel_overflow: {overflow}")
+    if engine is None:
+        engine = 'xlsxwriter' if xlsxwriter is not None else 'openpyxl'
+    workbook_class = _XlsxwriterWorkbook if engine == 'xlsxwriter' else _OpenpyxlWorkbook
+    sheet_capacity = EXCEL_MAX_ROWS - 1
+    
+    part = 1
+    workbook = workbook_class(file_path, columns)
+    workbook.add_sheet('Sheet1')
+    sheet_rows = 0
+    rows = 0
+    for batch in batches:
+        while batch:
+            if sheet_rows == sheet_capacity:
+                if overflow == 'error':
+                    workbook.discard()
+                    raise Sheet_too_large_Error()
+                part += 1
+                if overflow == 'sheets':
+                    workbook.add_sheet(f'Sheet{part}')
+                else:
+                    workbook.close()
+                    workbook = workbook_class(excel_part_path(file_path, part), columns)
+                    workbook.add_sheet('Sheet1')
+                sheet_rows = 0
+            room = sheet_capacity - sheet_rows
+            chunk, batch = batch[:room], batch[room:]
+            workbook.append_rows(chunk)
+            sheet_rows += len(chunk)
+            rows += len(chunk)
+    workbook.close()
+    
+    # Книги-продолжения от прошлого, более длинного запуска больше не относятся к результатам
+    stale_part = part + 1 if overflow == 'files' else 2
+    while os.path.isfile(excel_part_path(file_path, stale_part)):
+        os.remove(excel_part_path(file_path, stale_part))
+        stale_part += 1
+    return rows
+
+def excel_parts(rows: int) -> int:
+    """Сколько листов (или книг) Excel займут rows строк результатов."""
+    return max(1, -(-rows // (EXCEL_MAX_ROWS - 1)))
+
+class _XlsxwriterWorkbook:
+    """Книга xlsxwriter в режиме constant_memory: строки листа сразу уходят во временный файл."""
+    
+    def __init__(self, file_path: str, columns: Sequence[str]) -> None:
+        # Строки пишутся как есть: без превращения "=..." в формулы и адресов в ссылки
+        self.workbook = xlsxwriter.Workbook(file_path, {'constant_memory': True,
+                                                        'strings_to_formulas': False,
+                                                        'strings_to_urls': False})
+        self.bold = self.workbook.add_format({'bold': True})
+        self.columns = list(columns)
+        self.worksheet = None
+        self.row = 0
+    
+    def add_sheet(self, name: str) -> None:
+        self.worksheet = self.workbook.add_worksheet(name)
+        self.worksheet.write_row(0, 0, self.columns, self.bold)
+        self.row = 0
+    
+    def append_rows(self, batch: RowBatch) -> None:
+        # Пустые значения (None) xlsxwriter пропускает, ячейка остается пустой
+        write_row = self.worksheet.write_row
+        row = self.row
+        for values in batch:
+            row += 1
+            write_row(row, 0, values)
+        self.row = row
+    
+    def close(self) -> None:
+        try:
+            self.workbook.close()
+        except FileCreateError as e:
+            raise PermissionError(str(e))
+    
+    def discard(self) -> None:
+        # Файл xlsxwriter создается только в close(), временные файлы удалятся сами
+        pass
+
+class _OpenpyxlWorkbook:
+    """Книга openpyxl в режиме write_only."""
+    
+    def __init__(self, file_path: str, columns: Sequence[str]) -> None:
+        self.file_path = file_path
+        self.columns = list(columns)
+        self.workbook = Workbook(write_only=True)
+        self.worksheet = None
+    
+    def add_sheet(self, name: str) -> None:
+        self.worksheet = self.workbook.create_sheet(name)
+        header = []
+        for title in self.columns:
+            cell = WriteOnlyCell(self.worksheet, value=title)
+            cell.font = Font(bold=True)
+            header.append(cell)
+        self.worksheet.append(header)
+    
+    def append_rows(self, batch: RowBatch) -> None:
+        append = self.worksheet.append
+        for values in batch:
+            append(values)
+    
+    def close(self) -> None:
+        self.workbook.save(self.file_path)
+    
+    def discard(self) -> None:
+        # Потоки листов закрываются явно, иначе openpyxl пишет в уже закрытые
+        # файлы при сборке мусора
+        for worksheet in self.workbook.worksheets:
+            worksheet.close()
+
+def write_csv(batches: Iterable[RowBatch], file_path: str,
+              columns: Sequence[str] = ('data1', 'data2', 'score')) -> int:
+    """
+    Записывает строки результатов в CSV по мере поступления пакетов. Кодировка
+    utf-8 с BOM, чтобы Excel открывал кириллицу без настройки импорта.
+    """
+    rows = 0
+    with replaced_on_success(file_path) as tmp_path:
+        with open(tmp_path, 'w', encoding='utf-8-sig', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(columns)
+            for batch in batches:
+                writer.writerows(batch)
+                rows += len(batch)
+    return rows
+
+def _results_schema(columns: Sequence[str]) -> "pa.Schema":
+    # data1, data2_N - строки, score_N - дробные (пусто - оценка неизвестна), matches - целое
+    types = {'matches': pa.int64()}
+    return pa.schema([(column, pa.float64() if column.startswith('score') else types.get(column, pa.string()))
+                      for column in columns])
+
+def _record_batch(rows: RowBatch, schema: "pa.Schema") -> "pa.RecordBatch":
+    return pa.record_batch([pa.array(values, field_type) for values, field_type in zip(zip(*rows), schema.types)],
+                           schema=schema)
+
+def _record_batches(batches: Iterable[RowBatch], rows: int, schema: "pa.Schema") -> Iterator["pa.RecordBatch"]:
+    """Перекладывает пакеты строк в пакеты Arrow по rows строк (последний - меньше)."""
+    pending: RowBatch = []
+    for batch in batches:
+        pending.extend(batch)
+        while len(pending) >= rows:
+            yield _record_batch(pending[:rows], schema)
+            del pending[:rows]
+    if pending:
+        yield _record_batch(pending, schema)
+
+def write_parquet(batches: Iterable[RowBatch], file_path: str,
+                  row_group_rows: int = PARQUET_ROW_GROUP_ROWS,
+                  columns: Sequence[str] = ('data1', 'data2', 'score')) -> int:
+    """
+    Записывает строки результатов в Parquet по мере поступления пакетов:
+    каждые row_group_rows строк уходят в файл отдельной группой строк,
+    поэтому в памяти не накапливается весь результат.
+    """
+    require_pyarrow(file_path, "записи")
+    schema = _results_schema(columns)
+    rows = 0
+    with replaced_on_success(file_path) as tmp_path:
+        with pq.ParquetWriter(tmp_path, schema) as writer:
+            for record_batch in _record_batches(batches, row_group_rows, schema):
+                writer.write_batch(record_batch, row_group_size=row_group_rows)
+                rows += record_batch.num_rows
+    return rows
+
+def write_arrow(batches: Iterable[RowBatch], file_path: str,
+                rows_per_batch: int = PARQUET_ROW_GROUP_ROWS,
+                columns: Sequence[str] = ('data1', 'data2', 'score')) -> int:
+    """Записывает строки результатов в файл Arrow IPC (Feather v2) пакетами по мере поступления."""
+    require_pyarrow(file_path, "записи")
+    schema = _results_schema(columns)
+    rows = 0
+    with replaced_on_success(file_path) as tmp_path:
+        with pyarrow.ipc.new_file(tmp_path, schema) as writer:
+            for record_batch in _record_batches(batches, rows_per_batch, schema):
+                writer.write_batch(record_batch)
+                rows += record_batch.num_rows
+    return rows
+
+def write_sqlite(batches: Iterable[MatchBatch], file_path: str) -> int:
+    """
+    Записывает совпадения в базу SQLite (файл пересоздается целиком):
+    
+    data1 (id, value), data2 (id, value) - уникальные значения с индексом по value;
+    pairs (data1_id, data2_id, score)    - пары, ключ (data1_id, data2_id) и
+                                           индекс (data2_id, data1_id);
+    mapping                              - представление pairs с самими значениями.
+    
+    Все соответствия значения находятся по индексу, например
+    SELECT data2, score FROM mapping WHERE data1 = ?. Пакеты из генератора
+    записываются executemany в одной транзакции; индекс по data2_id строится
+    после загрузки, так быстрее, чем поддерживать его при каждой вставке.
+    """
+    # База собирается во временном файле: при отмене прежние результаты остаются целыми
+    with replaced_on_success(file_path) as tmp_path:
+        connection = sqlite3.connect(tmp_path)
+        try:
+            connection.executescript('''
+                PRAGMA journal_mode = MEMORY;
+                PRAGMA synchronous = OFF;
+                CREATE TABLE data1 (
+                    id INTEGER PRIMARY KEY,
+                    value TEXT NOT NULL UNIQUE
+                );
+                CREATE TABLE data2 (
+                    id INTEGER PRIMARY KEY,
+                    value TEXT NOT NULL UNIQUE
+                );
+                CREATE TABLE pairs (
+                    data1_id INTEGER NOT NULL REFERENCES data1 (id),
+                    data2_id INTEGER NOT NULL REFERENCES data2 (id),
+                    score REAL,
+                    PRIMARY KEY (data1_id, data2_id)
+                ) WITHOUT ROWID;
+                CREATE VIEW mapping AS
+                    SELECT data1.value AS data1, data2.value AS data2, pairs.score AS score
+                    FROM pairs
+                    JOIN data1 ON data1.id = pairs.data1_id
+                    JOIN data2 ON data2.id = pairs.data2_id;
+            ''')
+            # Идентификаторы значений выдаются здесь же, без обращений к базе
+            data1_ids: Dict[str, int] = {}
+            data2_ids: Dict[str, int] = {}
+            rows = 0
+            with connection:
+                for batch in batches:
+                    new_data1 = []
+                    new_data2 = []
+                    pairs = []
+                    for data1, data2, score in batch:
+                        data1, data2 = str(data1), str(data2)
+                        data1_id = data1_ids.get(data1)
+                        if data1_id is None:
+                            data1_id = data1_ids[data1] = len(data1_ids) + 1
+                            new_data1.append((data1_id, data1))
+                        data2_id = data2_ids.get(data2)
+                        if data2_id is None:
+                            data2_id = data2_ids[data2] = len(data2_ids) + 1
+                            new_data2.append((data2_id, data2))
+                        # Оценка неизвестна (у результатов старых запусков) - NULL
+                        pairs.append((data1_id, data2_id, score))
+                    connection.executemany("INSERT INTO data1 (id, value) VALUES (?, ?)", new_data1)
+                    connection.executemany("INSERT INTO data2 (id, value) VALUES (?, ?)", new_data2)
+                    connection.executemany(
+                        "INSERT OR IGNORE INTO pairs (data1_id, data2_id, score) VALUES (?, ?, ?)", pairs)
+                    rows += len(batch)
+                connection.execute("CREATE INDEX pairs_data2 ON pairs (data2_id, data1_id)")
+        finally:
+            connection.close()
+    return rows
+
+def write_unprocessed(rows: Iterable[str], file_path: str) -> None:
+    """Записывает строки data1, не обработанные в режиме ограничения времени."""
+    pd.DataFrame({'data1': list(rows)}).to_excel(file_path, index=False)